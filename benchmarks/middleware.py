@@ -0,0 +1,260 @@
+"""
+Benchmark `CsrfMiddleware` hot paths with SQLite and the local-memory cache.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/middleware.py --output before.json
+    PYTHONPATH=. python benchmarks/middleware.py --compare before.json
+
+Every scenario runs the whole middleware cycle with a view that uses the
+token. Queries and cache calls are counted in a separate pass, so the
+counting doesn't affect the timings.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import timeit
+from django.conf import settings
+
+
+TEMPLATE_VIEWS = 5
+
+
+def configure(path):
+    settings.configure(
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': path,
+            },
+        },
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+        },
+        INSTALLED_APPS=(
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'session_csrf',
+        ),
+        SECRET_KEY='benchmark',
+    )
+
+
+class CacheCalls(object):
+    """Counts calls of the cache methods while active"""
+    methods = ('get', 'set', 'add', 'delete', 'get_many', 'set_many',
+               'delete_many', 'incr', 'decr', 'has_key')
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.count = 0
+
+    def _wrap(self, method):
+        def wrapper(*args, **kwargs):
+            self.count += 1
+            return method(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        for name in self.methods:
+            setattr(self.cache, name, self._wrap(getattr(self.cache, name)))
+        return self
+
+    def __exit__(self, *exc_info):
+        for name in self.methods:
+            delattr(self.cache, name)
+
+
+class Scenario(object):
+    """Builds requests and renders a response for one hot path"""
+
+    def __init__(self, name, make_request, view=None, render=None):
+        self.name = name
+        self.make_request = make_request
+        self.view = view
+        self.render = render or (lambda request: request.csrf_token)
+
+    def run(self, middleware, request):
+        from django import http
+        middleware.process_request(request)
+        response = middleware.process_view(request, self.view, (), {})
+        if response is None:
+            response = http.HttpResponse(self.render(request))
+        return middleware.process_response(request, response)
+
+
+def get_scenarios():
+    import time
+    from django.contrib.auth.models import AnonymousUser, User
+    from django.template import Context, Template
+    from django.test import RequestFactory
+    from session_csrf.backends import get_backend
+    from session_csrf.decorators import per_view_csrf
+    from session_csrf.middlewares import CsrfMiddleware
+    from session_csrf import conf
+
+    rf = RequestFactory()
+    user = User.objects.create_user('benchmark', 'b@b.b', 'benchmark')
+    token = get_backend().issue(user)
+    session = {'csrf_token': token,
+               'csrf_token_issued': time.time(),
+               'csrf_token_generation': 0}
+
+    @per_view_csrf
+    def view(request):
+        pass
+    view_token = get_backend().issue(user, view.per_view_csrf_id)
+
+    def anonymous(request):
+        request.user = AnonymousUser()
+        request.session = {}
+        return request
+
+    def authenticated(request):
+        request.user = user
+        request.session = dict(session)
+        return request
+
+    # Steady state cookie of a returning anonymous user:
+    conf.ANON_ALWAYS = True
+    first = anonymous(rf.get('/'))
+    response = Scenario('', None).run(CsrfMiddleware(), first)
+    anon_cookie = response.cookies[conf.ANON_COOKIE].value
+    conf.ANON_ALWAYS = False
+
+    def anonymous_with_cookie():
+        request = rf.get('/')
+        request.COOKIES[conf.ANON_COOKIE] = anon_cookie
+        return anonymous(request)
+
+    template = Template('{% load session_csrf %}' + ''.join(
+        '{{% per_view_csrf "app.views.view_{}" %}}'.format(n)
+        for n in range(TEMPLATE_VIEWS)))
+
+    def render_template(request):
+        return template.render(Context({
+            'request': request, 'csrf_token': request.csrf_token}))
+
+    return [
+        Scenario('anonymous_get', lambda: anonymous(rf.get('/'))),
+        Scenario('anon_always_get', anonymous_with_cookie),
+        Scenario('authenticated_get', lambda: authenticated(rf.get('/'))),
+        Scenario('authenticated_post', lambda: authenticated(
+            rf.post('/', {'csrfmiddlewaretoken': token}))),
+        Scenario('per_view_post', lambda: authenticated(
+            rf.post('/', {'csrfmiddlewaretoken': view_token})), view),
+        Scenario('per_view_template', lambda: authenticated(rf.get('/')),
+                 render=render_template),
+    ]
+
+
+def measure(scenario, requests, count_requests):
+    """Time every request, then count queries and cache calls per request"""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from session_csrf.caches import get_csrf_cache
+    from session_csrf.middlewares import CsrfMiddleware
+    from session_csrf import conf
+
+    conf.ANON_ALWAYS = scenario.name == 'anon_always_get'
+    middleware = CsrfMiddleware()
+    timer = timeit.default_timer
+    timings = []
+    for _ in range(requests):
+        request = scenario.make_request()
+        started = timer()
+        scenario.run(middleware, request)
+        timings.append(timer() - started)
+
+    with CaptureQueriesContext(connection) as queries:
+        with CacheCalls(get_csrf_cache()) as cache_calls:
+            for _ in range(count_requests):
+                scenario.run(middleware, scenario.make_request())
+    conf.ANON_ALWAYS = False
+
+    timings.sort()
+    return {
+        'ops_per_sec': len(timings) / sum(timings),
+        'p50_us': timings[len(timings) // 2] * 1e6,
+        'p99_us': timings[int(len(timings) * 0.99)] * 1e6,
+        'db_queries': float(len(queries)) / count_requests,
+        'cache_calls': float(cache_calls.count) / count_requests,
+    }
+
+
+def get_meta(args):
+    import django
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'requests': args.requests,
+    }
+
+
+def compare(results, path):
+    with open(path) as f:
+        before = json.load(f)
+    print('\ncompared with {} ({}):'.format(
+        path, before['meta'].get('commit')))
+    for name, after in sorted(results['scenarios'].items()):
+        if name not in before['scenarios']:
+            continue
+        old = before['scenarios'][name]
+        print('{:<20} ops/s {:+.1%}  p99 {:+.1%}  '
+              'queries {:+.2f}  cache calls {:+.2f}'.format(
+                  name,
+                  after['ops_per_sec'] / old['ops_per_sec'] - 1,
+                  after['p99_us'] / old['p99_us'] - 1,
+                  after['db_queries'] - old['db_queries'],
+                  after['cache_calls'] - old['cache_calls']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--count-requests', type=int, default=100,
+                        help='requests used to count queries and cache calls')
+    parser.add_argument('--scenario', action='append',
+                        help='run only this scenario, can be repeated')
+    parser.add_argument('--output', help='save results as json')
+    parser.add_argument('--compare', help='json results to compare with')
+    args = parser.parse_args()
+
+    configure(os.path.join(tempfile.mkdtemp(), 'benchmark.db'))
+
+    from django.core.management import call_command
+    call_command('syncdb', interactive=False, verbosity=0)
+
+    results = {'meta': get_meta(args), 'scenarios': {}}
+    print('{:<20} {:>10} {:>10} {:>10} {:>8} {:>8}'.format(
+        'scenario', 'ops/s', 'p50 us', 'p99 us', 'queries', 'cache'))
+    for scenario in get_scenarios():
+        if args.scenario and scenario.name not in args.scenario:
+            continue
+        result = measure(scenario, args.requests, args.count_requests)
+        results['scenarios'][scenario.name] = result
+        print('{:<20} {ops_per_sec:>10.0f} {p50_us:>10.1f} {p99_us:>10.1f} '
+              '{db_queries:>8.2f} {cache_calls:>8.2f}'.format(
+                  scenario.name, **result))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark `TokenManager.has_valid` on a big tokens table in SQLite.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/token_lookup.py --rows 3000000
+
+Pass ``--without-index`` to drop the composite index and compare.
+"""
+import argparse
+from datetime import datetime, timedelta
+import os
+import random
+import tempfile
+import time
+from django.conf import settings
+
+
+def configure(path):
+    settings.configure(
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': path,
+            },
+        },
+        INSTALLED_APPS=(
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'session_csrf',
+        ),
+        SECRET_KEY='benchmark',
+        CSRF_TOKEN_CACHE_SIZE=0,
+    )
+
+
+def seed(rows, users, batch=50000):
+    """Fill tokens table, every 10th token is for a view"""
+    from django.db import connection, transaction
+    from session_csrf.models import Token, get_period
+    now = datetime.now()
+    tokens = []
+    sql = 'INSERT INTO {} (value, owner_id, created, period, for_view) ' \
+          'VALUES (%s, %s, %s, %s, %s)'.format(Token._meta.db_table)
+    cursor = connection.cursor()
+    with transaction.atomic():
+        for n in range(rows):
+            value = '%032x' % random.getrandbits(128)
+            owner = n % users + 1
+            # Per-view tokens are unique for owner and view:
+            for_view = 'app.views.view_{}'.format(n // users) \
+                if n % 10 == 0 else None
+            created = now - timedelta(minutes=n % (60 * 48))
+            period = get_period(time.mktime(created.timetuple()))
+            tokens.append((value, owner, created, period, for_view))
+            if len(tokens) == batch:
+                cursor.executemany(sql, tokens)
+                tokens = []
+        if tokens:
+            cursor.executemany(sql, tokens)
+
+def sample(count):
+    """Random existing tokens to look up"""
+    from session_csrf.models import Token
+    last_id = Token.objects.order_by('-id').values_list('id', flat=True)[0]
+    ids = [random.randint(1, last_id) for _ in range(count)]
+    return list(Token.objects.filter(id__in=ids).values_list(
+        'owner_id', 'value', 'for_view'))
+
+
+def explain(owner, value, for_view):
+    from django.db import connection
+    from session_csrf.models import Token
+    query = Token.objects._filter_valid(
+        owner=owner, value=value, for_view=for_view,
+    )[:1]
+    sql, params = query.values_list('created').query.sql_with_params()
+    cursor = connection.cursor()
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    return [row[-1] for row in cursor.fetchall()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--rows', type=int, default=3000000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--db', help='sqlite file, reused when exists')
+    parser.add_argument('--without-index', action='store_true')
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'tokens.db')
+    exists = os.path.exists(path)
+    configure(path)
+
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.db import connection
+    from session_csrf.models import Token
+
+    if not exists:
+        call_command('syncdb', interactive=False, verbosity=0)
+        started = time.time()
+        seed(args.rows, args.users)
+        print('seeded {} rows in {:.1f}s'.format(
+            args.rows, time.time() - started))
+
+    if args.without_index:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name = %s AND sql LIKE %s",
+            [Token._meta.db_table, '%"value"%'])
+        for name, in cursor.fetchall():
+            cursor.execute('DROP INDEX "{}"'.format(name))
+
+    tokens = sample(args.lookups)
+    owners = dict((pk, User(pk=pk)) for pk, _, _ in tokens)
+    print('rows: {}'.format(Token.objects.count()))
+    print('plan: {}'.format('; '.join(explain(*tokens[0]))))
+
+    started = time.time()
+    found = 0
+    for owner, value, for_view in tokens:
+        found += Token.objects.has_valid(owners[owner], value, for_view)
+    spent = time.time() - started
+    print('{} lookups ({} valid) in {:.3f}s: {:.0f} lookups/s, '
+          '{:.1f}us per lookup'.format(
+              len(tokens), found, spent, len(tokens) / spent,
+              spent / len(tokens) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,8 @@ DATABASES = {
     'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': 'test.db',
+            # Threads of the concurrency tests can't share in-memory db:
+            'TEST_NAME': 'test_threads.db',
     },
 }
 
@@ -48,4 +50,4 @@ export DJANGO_SETTINGS_MODULE=settings
 django-admin.py test session_csrf $@
 
 rm -f $SETTINGS*
-rm -f test.db
+rm -f test.db test_threads.db
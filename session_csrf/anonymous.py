@@ -0,0 +1,97 @@
+import time
+from django.core import signing
+from django.middleware import csrf as django_csrf
+from django.utils import baseconv
+from .caches import get_csrf_cache
+from .localcache import LocalCache
+from .utils import prep_key
+from . import conf, signals
+
+
+SALT = 'session_csrf.anonymous'
+
+# Process-local cache in front of the shared cache, keyed by the cache key:
+local_tokens = LocalCache(conf.ANON_LOCAL_CACHE_SIZE)
+
+
+def _get_signer():
+    return signing.TimestampSigner(salt=SALT)
+
+
+def _unsign(key):
+    """Get token and its signing time from the signed cookie"""
+    try:
+        token = _get_signer().unsign(key, max_age=conf.ANON_TIMEOUT)
+    except signing.BadSignature:
+        return '', None
+    # Signed value is `token:timestamp:signature`:
+    return token, baseconv.base62.decode(key.rsplit(':', 2)[1])
+
+
+def _get_cached(cache_key):
+    """Get token from the local cache or the shared one"""
+    value = local_tokens.get(cache_key)
+    if value is not None:
+        return value
+    started = time.time()
+    value = get_csrf_cache().get(cache_key, '')
+    signals.anonymous_token_read.send(
+        sender=None, found=bool(value), duration=time.time() - started)
+    if value:
+        local_tokens.set(
+            cache_key, value, time.time() + conf.ANON_LOCAL_CACHE_TIMEOUT)
+    return value
+
+
+def get_token(request):
+    """Get anonymous key, token and the last refresh time of the token
+    from the cookie and the cache, or only the cookie in signed mode"""
+    key = request.COOKIES.get(conf.ANON_COOKIE)
+    token = ''
+    refreshed = None
+    if key and conf.ANON_MODE == 'signed':
+        token, refreshed = _unsign(key)
+    elif key:
+        value = _get_cached(prep_key(key))
+        if isinstance(value, tuple):
+            token, refreshed = value
+        else:
+            token = value
+    return key, token, refreshed
+
+
+def need_refresh(refreshed):
+    """Is token should be stored again to not expire soon"""
+    return (refreshed is None
+            or time.time() - refreshed
+            >= conf.ANON_TIMEOUT * conf.ANON_REFRESH_RATIO)
+
+
+def issue_token(request):
+    """Get or create anonymous key and token, store them only when they're
+    new or should be refreshed. Returns key, token and is the cookie should
+    be sent. In signed mode the key is the signed token itself"""
+    key, token, refreshed = get_token(request)
+    if not token:
+        token = django_csrf._get_new_csrf_key()
+        refreshed = None
+    if not need_refresh(refreshed):
+        return key, token, False
+    if conf.ANON_MODE == 'signed':
+        return _get_signer().sign(token), token, True
+    if not key:
+        key = django_csrf._get_new_csrf_key()
+    started = time.time()
+    value = (token, started)
+    get_csrf_cache().set(prep_key(key), value, conf.ANON_TIMEOUT)
+    signals.anonymous_token_stored.send(
+        sender=None, duration=time.time() - started)
+    local_tokens.set(
+        prep_key(key), value, started + conf.ANON_LOCAL_CACHE_TIMEOUT)
+    return key, token, True
+
+
+def set_cookie(request, response, key):
+    """Set or reset the cookie timeout"""
+    response.set_cookie(conf.ANON_COOKIE, key, max_age=conf.ANON_TIMEOUT,
+                        httponly=True, secure=request.is_secure())
@@ -0,0 +1,24 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.importlib import import_module
+from .. import conf
+
+
+_backends = {}
+
+
+def load_backend(path):
+    """Load backend class by dotted path"""
+    module_path, _, class_name = path.rpartition('.')
+    try:
+        return getattr(import_module(module_path), class_name)
+    except (ImportError, AttributeError, ValueError) as e:
+        raise ImproperlyConfigured(
+            'Error loading csrf token backend {}: {}'.format(path, e))
+
+
+def get_backend():
+    """Get backend from CSRF_TOKEN_BACKEND setting"""
+    path = conf.CSRF_TOKEN_BACKEND
+    if path not in _backends:
+        _backends[path] = load_backend(path)()
+    return _backends[path]
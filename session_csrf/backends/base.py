@@ -0,0 +1,30 @@
+class BaseBackend(object):
+    """Base csrf token storage backend"""
+
+    def issue(self, owner, for_view=None):
+        """Issue token for owner, per-view tokens may be reused"""
+        raise NotImplementedError
+
+    def issue_many(self, owner, views, created=None):
+        """Issue tokens for views, returns dict with token for each view,
+        views with new tokens are added to `created` set"""
+        if created is not None:
+            created.update(views)
+        return dict((view, self.issue(owner, view)) for view in views)
+
+    def get_issued(self, owner, value, for_view=None):
+        """Get issue timestamp of token valid for owner and view, None when
+        token isn't valid"""
+        raise NotImplementedError
+
+    def validate(self, owner, value, for_view=None):
+        """Is token valid for owner and view"""
+        return self.get_issued(owner, value, for_view) is not None
+
+    def revoke(self, owner, value, for_view=None):
+        """Make token invalid before expiration"""
+        raise NotImplementedError
+
+    def purge_expired(self):
+        """Remove expired tokens from storage"""
+        raise NotImplementedError
@@ -0,0 +1,62 @@
+import time
+from django.middleware.csrf import _get_new_csrf_key
+from ..caches import get_csrf_cache
+from ..utils import _user_generation_key, prep_key
+from .. import conf
+from .base import BaseBackend
+
+
+class CacheBackend(BaseBackend):
+    """Store tokens in the cache, expired tokens are evicted by the cache"""
+
+    @property
+    def _timeout(self):
+        return int(conf.CSRF_TOKEN_LIFETIME.total_seconds())
+
+    def _token_key(self, owner, value, for_view):
+        return prep_key(u'token:{}:{}:{}'.format(
+            owner.pk, for_view or '', value))
+
+    def _view_key(self, owner, for_view):
+        return prep_key(u'view:{}:{}'.format(owner.pk, for_view))
+
+    def issue(self, owner, for_view=None):
+        if for_view is not None:
+            return self.issue_many(owner, [for_view])[for_view]
+        value = _get_new_csrf_key()
+        get_csrf_cache().set(
+            self._token_key(owner, value, None), time.time(), self._timeout)
+        return value
+
+    def issue_many(self, owner, views, created=None):
+        keys = dict((self._view_key(owner, view), view) for view in views)
+        generation_key = _user_generation_key(owner)
+        stored = get_csrf_cache().get_many(list(keys) + [generation_key])
+        generation = stored.pop(generation_key, 0)
+        # View keys store `(value, issued)`, tokens issued before revocation
+        # of the owner tokens are replaced:
+        tokens = dict((keys[key], value[0]) for key, value in stored.items()
+                      if isinstance(value, tuple) and value[1] >= generation)
+        new = {}
+        for key, view in keys.items():
+            if view not in tokens:
+                tokens[view] = value = _get_new_csrf_key()
+                issued = time.time()
+                new[key] = (value, issued)
+                new[self._token_key(owner, value, view)] = issued
+                if created is not None:
+                    created.add(view)
+        if new:
+            get_csrf_cache().set_many(new, self._timeout)
+        return tokens
+
+    def get_issued(self, owner, value, for_view=None):
+        return get_csrf_cache().get(self._token_key(owner, value, for_view))
+
+    def revoke(self, owner, value, for_view=None):
+        get_csrf_cache().delete(self._token_key(owner, value, for_view))
+        if for_view is not None:
+            get_csrf_cache().delete(self._view_key(owner, for_view))
+
+    def purge_expired(self):
+        pass
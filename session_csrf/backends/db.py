@@ -0,0 +1,30 @@
+from ..models import Token
+from .base import BaseBackend
+
+
+class DatabaseBackend(BaseBackend):
+    """Store tokens in the tokens table"""
+
+    def issue(self, owner, for_view=None):
+        if for_view is None:
+            return Token.objects.create(owner=owner).value
+        return self.issue_many(owner, [for_view])[for_view]
+
+    def issue_many(self, owner, views, created=None):
+        return Token.objects.issue_for_views(owner, views, created)
+
+    def get_issued(self, owner, value, for_view=None):
+        return Token.objects.get_issued(owner, value, for_view)
+
+    def revoke(self, owner, value, for_view=None):
+        for token in Token.objects.filter(
+            owner=owner, value=value, for_view=for_view,
+        ):
+            token.delete()
+
+    def purge_expired(self, batch_size=1000):
+        Token.objects.delete_expired_periods()
+        deleted, last_pk = Token.objects.delete_expired(batch_size)
+        while deleted:
+            deleted, last_pk = Token.objects.delete_expired(
+                batch_size, last_pk)
@@ -0,0 +1,102 @@
+import time
+from django.middleware.csrf import _get_new_csrf_key
+from django.utils.encoding import force_text
+from ..utils import get_user_generation
+from .. import conf
+from .base import BaseBackend
+
+
+class RedisBackend(BaseBackend):
+    """Store main and per-view tokens of a user in one redis hash, the hash
+    expires when no tokens were issued for the tokens lifetime"""
+
+    def __init__(self, client=None):
+        if client is None:
+            import redis
+            client = redis.StrictRedis.from_url(conf.CSRF_REDIS_URL)
+        self.client = client
+
+    @property
+    def _timeout(self):
+        return int(conf.CSRF_TOKEN_LIFETIME.total_seconds())
+
+    def _key(self, owner):
+        # Not hashed with `prep_key`, so expired fields can be found by scan:
+        return u'{}tokens:{}'.format(conf.PREFIX, owner.pk)
+
+    def _token_field(self, value, for_view):
+        return u't:{}:{}'.format(for_view or '', value)
+
+    def _view_field(self, for_view):
+        return u'v:{}'.format(for_view)
+
+    def _is_valid(self, issued):
+        return issued is not None and \
+            float(issued) + self._timeout > time.time()
+
+    def _store(self, owner, fields):
+        pipe = self.client.pipeline(transaction=False)
+        key = self._key(owner)
+        for field, value in fields.items():
+            pipe.hset(key, field, value)
+        pipe.expire(key, self._timeout)
+        pipe.execute()
+
+    def issue(self, owner, for_view=None):
+        if for_view is not None:
+            return self.issue_many(owner, [for_view])[for_view]
+        value = _get_new_csrf_key()
+        self._store(owner, {self._token_field(value, None): repr(time.time())})
+        return value
+
+    def issue_many(self, owner, views, created=None):
+        views = list(views)
+        if not views:
+            return {}
+        tokens = {}
+        new = {}
+        stored = self.client.hmget(
+            self._key(owner), [self._view_field(view) for view in views])
+        generation = get_user_generation(owner)
+        for view, field in zip(views, stored):
+            # Per-view fields are `issued:value`, tokens issued before
+            # revocation of the owner tokens are replaced:
+            issued, _, value = force_text(field or '').partition(':')
+            if field is not None and self._is_valid(issued) \
+                    and float(issued) >= generation:
+                tokens[view] = value
+            else:
+                tokens[view] = value = _get_new_csrf_key()
+                now = repr(time.time())
+                new[self._view_field(view)] = u'{}:{}'.format(now, value)
+                new[self._token_field(value, view)] = now
+                if created is not None:
+                    created.add(view)
+        if new:
+            self._store(owner, new)
+        return tokens
+
+    def get_issued(self, owner, value, for_view=None):
+        issued = self.client.hget(
+            self._key(owner), self._token_field(value, for_view))
+        if self._is_valid(issued):
+            return float(issued)
+
+    def revoke(self, owner, value, for_view=None):
+        fields = [self._token_field(value, for_view)]
+        if for_view is not None:
+            fields.append(self._view_field(for_view))
+        self.client.hdel(self._key(owner), *fields)
+
+    def purge_expired(self):
+        """Delete expired fields, whole hashes are expired by redis"""
+        for key in self.client.scan_iter(u'{}tokens:*'.format(conf.PREFIX)):
+            expired = []
+            for field, issued in self.client.hgetall(key).items():
+                field = force_text(field)
+                if field.startswith('v:'):
+                    issued = force_text(issued).partition(':')[0]
+                if not self._is_valid(issued):
+                    expired.append(field)
+            if expired:
+                self.client.hdel(key, *expired)
@@ -0,0 +1,40 @@
+import time
+from django.core import signing
+from django.utils import baseconv
+from .. import conf
+from .base import BaseBackend
+
+
+SALT = 'session_csrf.signed'
+
+
+class SignedBackend(BaseBackend):
+    """Stateless tokens with owner, issue time and view signed with
+    SECRET_KEY, they can't be revoked one by one"""
+
+    def issue(self, owner, for_view=None):
+        # The precise issue time is compared with revocations of the owner
+        # tokens, the signature timestamp has only seconds:
+        return signing.dumps([owner.pk, for_view, time.time()], salt=SALT)
+
+    def get_issued(self, owner, value, for_view=None):
+        try:
+            payload = signing.loads(
+                value, salt=SALT,
+                max_age=conf.CSRF_TOKEN_LIFETIME.total_seconds(),
+            )
+            pk, view = payload[:2]
+        except (signing.BadSignature, TypeError, ValueError):
+            return None
+        if pk == owner.pk and view == for_view:
+            if len(payload) > 2:
+                return payload[2]
+            # Signed value is `payload:timestamp:signature`:
+            return baseconv.base62.decode(value.rsplit(':', 2)[1])
+
+    def revoke(self, owner, value, for_view=None):
+        """Signed tokens aren't stored, so one token can't be revoked, it
+        stays valid until it expires or tokens of the owner are revoked"""
+
+    def purge_expired(self):
+        pass
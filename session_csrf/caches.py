@@ -0,0 +1,87 @@
+import bisect
+import hashlib
+from django.utils import six
+from . import conf
+
+
+_caches = {}
+
+
+def _hash(value):
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def _load_cache(alias):
+    try:
+        from django.core.cache import caches
+    except ImportError:
+        from django.core.cache import get_cache
+        return get_cache(alias)
+    return caches[alias]
+
+
+class ShardedCache(object):
+    """Spreads keys over several caches with consistent hashing, so adding
+    or removing a cache moves only a part of keys"""
+    points_per_cache = 100
+
+    def __init__(self, caches):
+        self._ring = sorted(
+            (_hash(u'{}:{}'.format(name, n)), cache)
+            for name, cache in caches.items()
+            for n in range(self.points_per_cache))
+        self._points = [point for point, _ in self._ring]
+
+    def get_cache(self, key):
+        """Get cache that stores the key"""
+        n = bisect.bisect(self._points, _hash(key)) % len(self._ring)
+        return self._ring[n][1]
+
+    def _group(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.get_cache(key), []).append(key)
+        return groups.items()
+
+    def get(self, key, *args, **kwargs):
+        return self.get_cache(key).get(key, *args, **kwargs)
+
+    def set(self, key, *args, **kwargs):
+        return self.get_cache(key).set(key, *args, **kwargs)
+
+    def add(self, key, *args, **kwargs):
+        return self.get_cache(key).add(key, *args, **kwargs)
+
+    def delete(self, key, *args, **kwargs):
+        return self.get_cache(key).delete(key, *args, **kwargs)
+
+    def get_many(self, keys, *args, **kwargs):
+        values = {}
+        for cache, cache_keys in self._group(keys):
+            values.update(cache.get_many(cache_keys, *args, **kwargs))
+        return values
+
+    def set_many(self, data, *args, **kwargs):
+        for cache, keys in self._group(data):
+            cache.set_many(
+                dict((key, data[key]) for key in keys), *args, **kwargs)
+
+    def delete_many(self, keys, *args, **kwargs):
+        for cache, cache_keys in self._group(keys):
+            cache.delete_many(cache_keys, *args, **kwargs)
+
+
+def get_csrf_cache():
+    """Get cache for csrf keys from CSRF_CACHE_ALIAS setting, keys are
+    sharded when it's a list of aliases"""
+    aliases = conf.CSRF_CACHE_ALIAS
+    if isinstance(aliases, six.string_types):
+        aliases = [aliases]
+    aliases = tuple(aliases)
+    if aliases not in _caches:
+        if len(aliases) == 1:
+            _caches[aliases] = _load_cache(aliases[0])
+        else:
+            _caches[aliases] = ShardedCache(dict(
+                (alias, _load_cache(alias)) for alias in aliases))
+    return _caches[aliases]
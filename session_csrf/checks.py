@@ -0,0 +1,65 @@
+import io
+import os
+from django.conf import settings
+from django.core.urlresolvers import get_resolver
+from django.template import Template
+from . import registry
+try:
+    from django.core.checks import Warning, register
+except ImportError:
+    # System checks framework is available since Django 1.7
+    register = None
+
+
+def _get_template_dirs():
+    try:
+        from django.template.loaders.app_directories import app_template_dirs
+    except ImportError:
+        from django.template.utils import get_app_template_dirs
+        app_template_dirs = get_app_template_dirs('templates')
+    return tuple(getattr(settings, 'TEMPLATE_DIRS', ())) + tuple(
+        app_template_dirs)
+
+
+def _load_views(patterns):
+    """Import views of url patterns, so decorated views are registered"""
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            _load_views(pattern.url_patterns)
+        else:
+            pattern.callback
+
+
+def _compile_templates():
+    """Compile all templates, so used view names are known"""
+    for template_dir in _get_template_dirs():
+        for root, _, files in os.walk(template_dir):
+            for name in files:
+                try:
+                    with io.open(os.path.join(root, name),
+                                 encoding=settings.FILE_CHARSET) as f:
+                        Template(f.read())
+                except Exception:
+                    # Not a django template
+                    continue
+
+
+def get_unknown_view_names():
+    """Get view names used with per_view_csrf in templates without
+    registered per-view csrf views"""
+    _load_views(get_resolver(None).url_patterns)
+    _compile_templates()
+    return registry.get_unknown_names()
+
+
+if register is not None:
+    @register()
+    def check_view_names(app_configs=None, **kwargs):
+        return [
+            Warning(
+                'per_view_csrf is used with unknown view "{}"'.format(name),
+                hint='Decorate the view with per_view_csrf or use '
+                     'PerViewCsrfMixin.',
+                id='session_csrf.W001',
+            ) for name in get_unknown_view_names()
+        ]
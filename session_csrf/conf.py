@@ -5,8 +5,62 @@ from django.conf import settings
 ANON_COOKIE = getattr(settings, 'ANON_COOKIE', 'anoncsrf')
 ANON_TIMEOUT = getattr(settings, 'ANON_TIMEOUT', 60 * 60 * 2)  # 2 hours.
 ANON_ALWAYS = getattr(settings, 'ANON_ALWAYS', False)
+# 'cache' stores anonymous tokens in the cache, 'signed' in signed cookies:
+ANON_MODE = getattr(settings, 'ANON_MODE', 'cache')
+# Part of ANON_TIMEOUT after which anonymous token and cookie are refreshed:
+ANON_REFRESH_RATIO = getattr(settings, 'ANON_REFRESH_RATIO', 0.25)
+# Max amount of anonymous tokens cached in each process, 0 disables the cache:
+ANON_LOCAL_CACHE_SIZE = getattr(settings, 'ANON_LOCAL_CACHE_SIZE', 0)
+# Seconds anonymous tokens stay in the process-local cache:
+ANON_LOCAL_CACHE_TIMEOUT = getattr(settings, 'ANON_LOCAL_CACHE_TIMEOUT', 10)
 PREFIX = 'sessioncsrf:'
 
 CSRF_TOKEN_LIFETIME = getattr(
     settings, 'CSRF_TOKEN_LIFETIME', timedelta(days=1),
 )
+
+# Max amount of validated tokens cached in each process, 0 disables the cache:
+CSRF_TOKEN_CACHE_SIZE = getattr(settings, 'CSRF_TOKEN_CACHE_SIZE', 0)
+
+# Use stateless tokens signed with SECRET_KEY instead of the tokens table:
+CSRF_SIGNED_TOKENS = getattr(settings, 'CSRF_SIGNED_TOKENS', False)
+
+CSRF_TOKEN_BACKEND = getattr(
+    settings, 'CSRF_TOKEN_BACKEND',
+    'session_csrf.backends.signed.SignedBackend' if CSRF_SIGNED_TOKENS
+    else 'session_csrf.backends.db.DatabaseBackend',
+)
+
+# Bump to make the middleware re-check tokens that sessions prove as valid:
+CSRF_TOKEN_GENERATION = getattr(settings, 'CSRF_TOKEN_GENERATION', 0)
+
+# Amount of recently issued tokens kept in the session and accepted until
+# they expire, so open tabs with a replaced token still work:
+CSRF_TOKEN_RING_SIZE = getattr(settings, 'CSRF_TOKEN_RING_SIZE', 4)
+
+# Part of the token lifetime after which the token is replaced, so replaced
+# tokens in the ring still have time left, 1 replaces only expired tokens:
+CSRF_TOKEN_ROTATE_RATIO = getattr(settings, 'CSRF_TOKEN_ROTATE_RATIO', 0.5)
+
+# Collect metrics from the signals for `session_csrf.metrics.metrics_view`:
+CSRF_METRICS = getattr(settings, 'CSRF_METRICS', False)
+
+# Seconds concurrent requests of a user wait for and share a new token, 0
+# makes every request issue its own token:
+CSRF_TOKEN_ISSUE_TIMEOUT = getattr(settings, 'CSRF_TOKEN_ISSUE_TIMEOUT', 5)
+
+# Cache alias for csrf keys, a list of aliases shards keys between caches:
+CSRF_CACHE_ALIAS = getattr(settings, 'CSRF_CACHE_ALIAS', 'default')
+
+# Redis url for `session_csrf.backends.redis_backend.RedisBackend`:
+CSRF_REDIS_URL = getattr(
+    settings, 'CSRF_REDIS_URL', 'redis://localhost:6379/0')
+
+# Path prefixes and regexes of requests without csrf checks and tokens:
+CSRF_EXEMPT_PATHS = getattr(settings, 'CSRF_EXEMPT_PATHS', ())
+CSRF_EXEMPT_PATH_REGEXES = getattr(settings, 'CSRF_EXEMPT_PATH_REGEXES', ())
+
+# Authorization header schemes of API clients that don't need csrf, like
+# 'Bearer', and dotted paths of predicates called with the request:
+CSRF_EXEMPT_AUTH_SCHEMES = getattr(settings, 'CSRF_EXEMPT_AUTH_SCHEMES', ())
+CSRF_EXEMPT_PREDICATES = getattr(settings, 'CSRF_EXEMPT_PREDICATES', ())
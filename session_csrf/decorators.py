@@ -1,9 +1,6 @@
 import functools
-from django.core.cache import cache
-from django.middleware import csrf as django_csrf
 from django.utils.cache import patch_vary_headers
-from .utils import prep_key
-from . import conf
+from . import anonymous, conf, registry
 
 
 def anonymous_csrf(f):
@@ -12,19 +9,11 @@ def anonymous_csrf(f):
     def wrapper(request, *args, **kw):
         use_anon_cookie = not (request.user.is_authenticated() or conf.ANON_ALWAYS)
         if use_anon_cookie:
-            if conf.ANON_COOKIE in request.COOKIES:
-                key = request.COOKIES[conf.ANON_COOKIE]
-                token = cache.get(prep_key(key)) or django_csrf._get_new_csrf_key()
-            else:
-                key = django_csrf._get_new_csrf_key()
-                token = django_csrf._get_new_csrf_key()
-            cache.set(prep_key(key), token, conf.ANON_TIMEOUT)
-            request.csrf_token = token
+            key, request.csrf_token, refresh = anonymous.issue_token(request)
         response = f(request, *args, **kw)
         if use_anon_cookie:
-            # Set or reset the cache and cookie timeouts.
-            response.set_cookie(conf.ANON_COOKIE, key, max_age=conf.ANON_TIMEOUT,
-                                httponly=True, secure=request.is_secure())
+            if refresh:
+                anonymous.set_cookie(request, response, key)
             patch_vary_headers(response, ['Cookie'])
         return response
     return wrapper
@@ -39,4 +28,4 @@ def anonymous_csrf_exempt(f):
 def per_view_csrf(fn):
     """Require per view csrf"""
     fn.per_view_csrf = True
-    return fn
+    return registry.register(fn)
@@ -0,0 +1,22 @@
+from django.db import models
+
+
+class TokenValueField(models.CharField):
+    """Token value stored in fixed-width ascii column"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', 32)
+        super(TokenValueField, self).__init__(*args, **kwargs)
+
+    def db_type(self, connection):
+        if connection.vendor == 'mysql':
+            return 'char({}) character set ascii collate ascii_bin'.format(
+                self.max_length)
+        return 'char({})'.format(self.max_length)
+
+
+try:
+    from south.modelsinspector import add_introspection_rules
+    add_introspection_rules([], [r'^session_csrf\.fields\.TokenValueField'])
+except ImportError:
+    pass
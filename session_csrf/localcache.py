@@ -0,0 +1,49 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class LocalCache(object):
+    """Bounded in-process LRU cache with per-entry expiration"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, key, default=None):
+        """Get not expired value and mark it as recently used"""
+        with self._lock:
+            try:
+                value, expires = self._entries.pop(key)
+            except KeyError:
+                return default
+            if expires <= time.time():
+                return default
+            self._entries[key] = (value, expires)
+            return value
+
+    def set(self, key, value, expires):
+        """Store value until `expires` timestamp, evict least recently used"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
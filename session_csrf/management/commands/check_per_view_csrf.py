@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from ...checks import get_unknown_view_names
+
+
+class Command(BaseCommand):
+    help = 'Check that view names used with per_view_csrf in templates ' \
+           'belong to registered per-view csrf views.'
+
+    def handle(self, **options):
+        names = get_unknown_view_names()
+        for name in names:
+            self.stderr.write('Unknown per-view csrf view: {}'.format(name))
+        if names:
+            raise CommandError('Found {} unknown view names'.format(
+                len(names)))
+        if int(options.get('verbosity', 1)):
+            self.stdout.write('All per-view csrf view names are known')
@@ -0,0 +1,52 @@
+from optparse import make_option
+import time
+from django.core.management.base import BaseCommand
+from ...models import Token
+
+
+class Command(BaseCommand):
+    help = 'Delete expired csrf tokens in batches ordered by primary key. ' \
+           'Interrupted run can be resumed with --start-after.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=1000,
+                    help='Amount of tokens deleted with one query.'),
+        make_option('--sleep', type='float', default=0,
+                    help='Seconds to sleep between batches.'),
+        make_option('--start-after', type='int', default=0,
+                    help='Skip tokens with primary key up to this one.'),
+        make_option('--by-period', action='store_true', default=False,
+                    help='Drop whole old periods with one query for each '
+                         'before deleting the rest in batches.'),
+    )
+
+    def handle(self, batch_size, sleep, start_after, by_period=False,
+               **options):
+        verbosity = int(options.get('verbosity', 1))
+        started = time.time()
+        total = 0
+        if by_period:
+            total = Token.objects.delete_expired_periods()
+            if verbosity > 1:
+                self.stdout.write('Deleted {} tokens of old periods'.format(
+                    total))
+        last_pk = start_after
+        try:
+            while True:
+                deleted, last_pk = Token.objects.delete_expired(
+                    batch_size, last_pk)
+                if not deleted:
+                    break
+                total += deleted
+                if verbosity > 1:
+                    self.stdout.write('Deleted {} tokens up to {}'.format(
+                        deleted, last_pk))
+                if sleep:
+                    time.sleep(sleep)
+        except KeyboardInterrupt:
+            self.stdout.write('Interrupted, resume with --start-after={}'
+                              .format(last_pk))
+        spent = time.time() - started
+        if verbosity:
+            self.stdout.write(
+                'Deleted {} expired tokens in {:.2f}s ({:.0f} tokens/s)'
+                .format(total, spent, total / spent if spent else total))
@@ -0,0 +1,157 @@
+from collections import defaultdict
+import threading
+from django import http
+from . import signals
+
+
+DURATION_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels))
+
+
+class Collector(object):
+    """In-process counters and duration histograms fed by the signals,
+    rendered in the Prometheus text format"""
+
+    def __init__(self, prefix='session_csrf', buckets=DURATION_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._receivers = [
+            (signals.token_cache_checked, self._on_cache_checked),
+            (signals.token_validated, self._on_validated),
+            (signals.tokens_issued, self._on_issued),
+            (signals.anonymous_token_read, self._on_anonymous_read),
+            (signals.anonymous_token_stored, self._on_anonymous_stored),
+            (signals.request_rejected, self._on_rejected),
+        ]
+
+    def connect(self):
+        for signal, receiver in self._receivers:
+            signal.connect(receiver, dispatch_uid=(id(self), receiver))
+
+    def disconnect(self):
+        for signal, receiver in self._receivers:
+            signal.disconnect(dispatch_uid=(id(self), receiver))
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def inc(self, name, help, labels=(), amount=1):
+        """Increase counter"""
+        with self._lock:
+            self._help[name] = (help, 'counter')
+            self._counters[name, labels] += amount
+
+    def observe(self, name, help, value, labels=()):
+        """Add value to histogram"""
+        with self._lock:
+            self._help[name] = (help, 'histogram')
+            counts, total, count = self._histograms.get(
+                (name, labels), ([0] * len(self.buckets), 0.0, 0))
+            for n, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[n] += 1
+            self._histograms[name, labels] = counts, total + value, count + 1
+
+    def render(self):
+        """Get metrics in the Prometheus text format"""
+        with self._lock:
+            lines = []
+            for name in sorted(self._help):
+                help, kind = self._help[name]
+                full_name = '{}_{}'.format(self.prefix, name)
+                lines.append('# HELP {} {}'.format(full_name, help))
+                lines.append('# TYPE {} {}'.format(full_name, kind))
+                if kind == 'counter':
+                    lines.extend(self._render_counter(name, full_name))
+                else:
+                    lines.extend(self._render_histogram(name, full_name))
+            return '\n'.join(lines) + '\n'
+
+    def _render_counter(self, name, full_name):
+        for (key, labels), value in sorted(self._counters.items()):
+            if key == name:
+                yield '{}{} {}'.format(
+                    full_name, _format_labels(labels), repr(value))
+
+    def _render_histogram(self, name, full_name):
+        for (key, labels), (counts, total, count) in sorted(
+            self._histograms.items(),
+        ):
+            if key != name:
+                continue
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield '{}_bucket{} {}'.format(
+                    full_name, _format_labels(labels + (('le', bound),)),
+                    bucket_count)
+            yield '{}_bucket{} {}'.format(
+                full_name, _format_labels(labels + (('le', '+Inf'),)), count)
+            yield '{}_sum{} {}'.format(
+                full_name, _format_labels(labels), repr(total))
+            yield '{}_count{} {}'.format(
+                full_name, _format_labels(labels), count)
+
+    def _on_cache_checked(self, hit, duration, **kwargs):
+        result = (('result', 'hit' if hit else 'miss'),)
+        self.inc('token_cache_total', 'Checks of the validated tokens cache.',
+                 result)
+        self.observe('token_cache_seconds',
+                     'Time of validated tokens cache checks.', duration,
+                     result)
+
+    def _on_validated(self, valid, duration, **kwargs):
+        result = (('result', 'valid' if valid else 'invalid'),)
+        self.inc('token_validations_total',
+                 'Tokens checked in the backend.', result)
+        self.observe('token_validation_seconds',
+                     'Time of token checks in the backend.', duration, result)
+
+    def _on_issued(self, views, duration, **kwargs):
+        self.inc('tokens_issued_total', 'Tokens issued by the backend.',
+                 amount=len(views))
+        self.observe('token_issue_seconds',
+                     'Time of issuing tokens by the backend.', duration)
+
+    def _on_anonymous_read(self, found, duration, **kwargs):
+        self.inc('anonymous_cache_reads_total',
+                 'Anonymous tokens read from the cache.',
+                 (('result', 'hit' if found else 'miss'),))
+        self.observe('anonymous_cache_seconds',
+                     'Time of anonymous tokens cache calls.', duration,
+                     (('operation', 'get'),))
+
+    def _on_anonymous_stored(self, duration, **kwargs):
+        self.inc('anonymous_cache_writes_total',
+                 'Anonymous tokens stored to the cache.')
+        self.observe('anonymous_cache_seconds',
+                     'Time of anonymous tokens cache calls.', duration,
+                     (('operation', 'set'),))
+
+    def _on_rejected(self, reason, duration, **kwargs):
+        self.inc('rejections_total', 'Requests rejected by csrf check.',
+                 (('reason', reason),))
+        self.observe('rejection_check_seconds',
+                     'Time of csrf checks of rejected requests.', duration)
+
+
+collector = Collector()
+
+
+def metrics_view(request):
+    """Expose metrics of the default collector"""
+    return http.HttpResponse(
+        collector.render(), content_type='text/plain; version=0.0.4')
@@ -1,69 +1,227 @@
-from django.core.cache import cache
+import functools
+import time
 from django.middleware import csrf as django_csrf
 from django.utils import crypto
 from django.utils.cache import patch_vary_headers
-from .models import Token
-from .utils import prep_key
-from . import conf
+from .backends import get_backend
+from .caches import get_csrf_cache
+from .utils import (
+    LazyToken, get_token_generation, get_user_generation, is_exempt_path,
+    is_exempt_request, prep_key, resolve_token,
+)
+from . import anonymous, conf, registry, signals
+
+
+# Seconds between checks for the token issued by a concurrent request:
+ISSUE_POLL_INTERVAL = 0.05
 
 
 class CsrfMiddleware(object):
+    """Works both in MIDDLEWARE_CLASSES and in new-style MIDDLEWARE"""
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Process request as new-style middleware"""
+        response = self.process_request(request)
+        if response is None:
+            response = self.get_response(request)
+        return self.process_response(request, response)
 
     # csrf_processing_done prevents checking CSRF more than once. That could
     # happen if the requires_csrf_token decorator is used.
     def _accept(self, request):
         request.csrf_processing_done = True
 
-    def _reject(self, request, reason):
+    def _reject(self, request, reason, started=None):
+        if started is not None:
+            signals.request_rejected.send(
+                sender=self.__class__, request=request, reason=reason,
+                duration=time.time() - started)
         return django_csrf._get_failure_view()(request, reason)
 
+    def _store_token(self, request, token, issued):
+        """Store token with its issue time and generation in the session,
+        the token is added to the ring of recent tokens"""
+        session = request.session
+        generation = get_token_generation(request.user)
+        ring = []
+        if session.get('csrf_token_generation') == generation:
+            expiration = time.time() - conf.CSRF_TOKEN_LIFETIME.total_seconds()
+            ring = [[value, value_issued] for value, value_issued
+                    in session.get('csrf_tokens', ())
+                    if value != token and value_issued > expiration]
+        ring.append([token, issued])
+        session['csrf_tokens'] = ring[-conf.CSRF_TOKEN_RING_SIZE:]
+        session['csrf_token'] = token
+        session['csrf_token_issued'] = issued
+        session['csrf_token_generation'] = generation
+
+    def _get_user_generation(self, request):
+        """Get revocation generation of the user, memoized for the request"""
+        generations = request.__dict__.setdefault('_csrf_user_generation', {})
+        if request.user.pk not in generations:
+            generations[request.user.pk] = get_user_generation(request.user)
+        return generations[request.user.pk]
+
+    def _is_proved_by_session(self, request, token):
+        """Is session proves that token is still valid"""
+        session = request.session
+        issued = session.get('csrf_token_issued')
+        return (
+            issued is not None
+            and session.get('csrf_token') == token
+            and session.get('csrf_token_generation')
+            == get_token_generation(request.user)
+            and issued + conf.CSRF_TOKEN_LIFETIME.total_seconds()
+            > time.time()
+            and issued >= self._get_user_generation(request)
+        )
+
+    def _is_in_ring(self, request, token):
+        """Is token one of the recent tokens of the session, every token of
+        the ring is compared, so the time doesn't depend on the match"""
+        session = request.session
+        ring = session.get('csrf_tokens')
+        if not ring or not request.user.is_authenticated() \
+                or session.get('csrf_token_generation') \
+                != get_token_generation(request.user):
+            return False
+        expiration = time.time() - conf.CSRF_TOKEN_LIFETIME.total_seconds()
+        generation = self._get_user_generation(request)
+        found = False
+        for value, issued in ring:
+            if crypto.constant_time_compare(token, value) \
+                    and expiration < issued and issued >= generation:
+                found = True
+        return found
+
+    def _should_rotate(self, request):
+        """Is valid session token old enough to be replaced, the replaced
+        one stays in the ring until it expires"""
+        issued = request.session.get('csrf_token_issued')
+        return issued is not None and issued \
+            + conf.CSRF_TOKEN_LIFETIME.total_seconds() \
+            * conf.CSRF_TOKEN_ROTATE_RATIO < time.time()
+
+    def _get_issued(self, request, token, for_view=None):
+        """Get token issue time from backend, memoized for the request"""
+        checked = request.__dict__.setdefault('_csrf_checked', {})
+        key = (request.user.pk, token, for_view)
+        if key not in checked:
+            started = time.time()
+            checked[key] = get_backend().get_issued(
+                request.user, token, for_view)
+            signals.token_validated.send(
+                sender=self.__class__, user=request.user, for_view=for_view,
+                valid=checked[key] is not None,
+                duration=time.time() - started)
+        return checked[key]
+
+    def _is_valid_token(self, request, token):
+        """Is token valid, asks backend only when session can't prove it"""
+        if self._is_proved_by_session(request, token):
+            return True
+        issued = self._get_issued(request, token)
+        if issued is None or issued < self._get_user_generation(request):
+            return False
+        if request.session.get('csrf_token') == token:
+            self._store_token(request, token, issued)
+        return True
+
     def _has_valid_csrf(self, request):
         """Is request has valid csrf token"""
         if 'csrf_token' not in request.session:
             return False
         else:
-            return Token.objects.has_valid(
-                request.user,
-                request.session['csrf_token']
-            )
+            return self._is_valid_token(
+                request, request.session['csrf_token'])
 
     def process_request(self, request):
         """
-        Add a CSRF token to the session for logged-in users.
+        Add a lazy CSRF token to the request.
 
-        The token is available at request.csrf_token.
+        The token is available at request.csrf_token, the session and the
+        token storage are touched only when it's used. Requests to exempt
+        paths and requests of exempt API clients get no token and aren't
+        checked.
         """
         if hasattr(request, 'csrf_token'):
             return
+        if is_exempt_path(request.path_info) or is_exempt_request(request):
+            request.csrf_processing_done = True
+            return
+        request.csrf_token = LazyToken(
+            functools.partial(self._resolve_token, request))
+
+    def _issue_new_token(self, request):
+        """Issue new token, returns it with its issue time"""
+        issued = time.time()
+        token = get_backend().issue(request.user)
+        signals.tokens_issued.send(
+            sender=self.__class__, user=request.user, views=[None],
+            duration=time.time() - issued)
+        return token, issued
+
+    def _issue_token(self, request):
+        """Issue new token, concurrent requests of the user converge on the
+        token issued by the request that took the lock in the cache"""
+        timeout = conf.CSRF_TOKEN_ISSUE_TIMEOUT
+        if not timeout:
+            return self._issue_new_token(request)
+        name = 'issued:{}:{}:{}'.format(
+            request.user.pk, get_token_generation(request.user),
+            self._get_user_generation(request))
+        key = prep_key(name)
+        lock_key = prep_key(name + ':lock')
+        cache = get_csrf_cache()
+        deadline = time.time() + timeout
+        while True:
+            issued = cache.get(key)
+            if issued is not None:
+                return issued
+            if cache.add(lock_key, True, timeout):
+                try:
+                    issued = self._issue_new_token(request)
+                except Exception:
+                    # Don't make other requests wait for the failed issue:
+                    cache.delete(lock_key)
+                    raise
+                cache.set(key, issued, timeout)
+                return issued
+            if time.time() >= deadline:
+                # The lock owner failed to issue the token:
+                return self._issue_new_token(request)
+            time.sleep(ISSUE_POLL_INTERVAL)
+
+    def _resolve_token(self, request):
+        """
+        Get the CSRF token, it's added to the session for logged-in users.
+        """
         if request.user.is_authenticated():
-            if self._has_valid_csrf(request):
-                request.csrf_token = request.session['csrf_token']
-            else:
-                token = Token.objects.create(owner=request.user).value
-                request.csrf_token = request.session['csrf_token'] = token
+            if self._has_valid_csrf(request) \
+                    and not self._should_rotate(request):
+                return request.session['csrf_token']
+            token, issued = self._issue_token(request)
+            self._store_token(request, token, issued)
+            return token
+        elif conf.ANON_ALWAYS:
+            key, token, refresh = anonymous.issue_token(request)
+            request._anon_csrf_key = key
+            request._anon_csrf_refresh = refresh
+            return token
         else:
-            key = None
-            token = ''
-            if conf.ANON_COOKIE in request.COOKIES:
-                key = request.COOKIES[conf.ANON_COOKIE]
-                token = cache.get(prep_key(key), '')
-            if conf.ANON_ALWAYS:
-                if not key:
-                    key = django_csrf._get_new_csrf_key()
-                if not token:
-                    token = django_csrf._get_new_csrf_key()
-                request._anon_csrf_key = key
-                cache.set(prep_key(key), token, conf.ANON_TIMEOUT)
-            request.csrf_token = token
+            return anonymous.get_token(request)[1]
 
     def _check_per_view_csrf(self, request, view, user_token):
         """Check per view csrf token"""
-        view_full_name = '{}.{}'.format(
-            view.__module__,
-            view.__name__,
-        )
-        return Token.objects.has_valid(
-            request.user, user_token, view_full_name)
+        view_id = getattr(view, 'per_view_csrf_id', None)
+        if view_id is None:
+            view_id = registry.get_view_id(registry.get_view_name(view))
+        issued = self._get_issued(request, user_token, view_id)
+        return issued is not None \
+            and issued >= self._get_user_generation(request)
 
     def _need_per_view_csrf(self, request, view):
         """Is view need per-view csrf token"""
@@ -77,6 +235,7 @@ class CsrfMiddleware(object):
 
     def process_view(self, request, view_func, *args, **kwargs):
         """Check the CSRF token if this is a POST."""
+        started = time.time()
         if getattr(request, 'csrf_processing_done', False):
             return
 
@@ -106,27 +265,30 @@ class CsrfMiddleware(object):
             if self._check_per_view_csrf(request, view_func, user_token):
                 return self._accept(request)
             else:
-                return self._reject(request, django_csrf.REASON_BAD_TOKEN)
+                return self._reject(
+                    request, django_csrf.REASON_BAD_TOKEN, started)
+
+        # Recent tokens of the session are accepted without the storage:
+        if user_token and self._is_in_ring(request, user_token):
+            return self._accept(request)
 
-        request_token = getattr(request, 'csrf_token', '')
+        request_token = resolve_token(getattr(request, 'csrf_token', ''))
         # Check that both strings aren't empty and then check for a match.
         if not ((user_token or request_token)
                 and crypto.constant_time_compare(user_token, request_token))\
                 or (request.user.is_authenticated()
-                    and not Token.objects.has_valid(request.user, request_token)):
+                    and not self._is_valid_token(request, request_token)):
             reason = django_csrf.REASON_BAD_TOKEN
             django_csrf.logger.warning(
                 'Forbidden (%s): %s' % (reason, request.path),
                 extra=dict(status_code=403, request=request))
-            return self._reject(request, reason)
+            return self._reject(request, reason, started)
         else:
             return self._accept(request)
 
     def process_response(self, request, response):
         if hasattr(request, '_anon_csrf_key'):
-            # Set or reset the cache and cookie timeouts.
-            response.set_cookie(conf.ANON_COOKIE, request._anon_csrf_key,
-                                max_age=conf.ANON_TIMEOUT, httponly=True,
-                                secure=request.is_secure())
+            if request._anon_csrf_refresh:
+                anonymous.set_cookie(request, response, request._anon_csrf_key)
             patch_vary_headers(response, ['Cookie'])
         return response
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import datetime
+import time
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+from django.conf import settings
+from session_csrf import conf
+
+
+PREFIX = getattr(settings, 'TABLE_PREFIX', '')
+TABLE_PREFIX = len(PREFIX) > 0 and "%s_" % PREFIX or PREFIX
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'Token.period'
+        db.add_column('%ssession_csrf_token' % TABLE_PREFIX, 'period',
+                      self.gf('django.db.models.fields.IntegerField')(default=0),
+                      keep_default=False)
+        # Adding index on 'Token', fields ['period'], it's created here
+        # because South defers the index of a new field and doesn't create
+        # it on SQLite at all
+        db.create_index('%ssession_csrf_token' % TABLE_PREFIX, ['period'])
+        # Filling periods of tokens that are still valid, expired ones stay
+        # in the period 0 and are dropped with it
+        if not db.dry_run:
+            lifetime = conf.CSRF_TOKEN_LIFETIME.total_seconds()
+            current = int(time.time() // lifetime)
+            for period in (current - 1, current):
+                orm['session_csrf.Token'].objects.filter(
+                    created__gte=datetime.datetime.fromtimestamp(period * lifetime),
+                    created__lt=datetime.datetime.fromtimestamp((period + 1) * lifetime),
+                ).update(period=period)
+        # Removing index on 'Token', fields ['owner', 'value', 'for_view', 'created']
+        db.delete_index('%ssession_csrf_token' % TABLE_PREFIX, ['owner_id', 'value', 'for_view', 'created'])
+        # Adding index on 'Token', fields ['owner', 'value', 'for_view', 'period', 'created']
+        db.create_index('%ssession_csrf_token' % TABLE_PREFIX, ['owner_id', 'value', 'for_view', 'period', 'created'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'Token', fields ['owner', 'value', 'for_view', 'period', 'created']
+        db.delete_index('%ssession_csrf_token' % TABLE_PREFIX, ['owner_id', 'value', 'for_view', 'period', 'created'])
+        # Removing index on 'Token', fields ['period']
+        db.delete_index('%ssession_csrf_token' % TABLE_PREFIX, ['period'])
+        # Deleting field 'Token.period'
+        db.delete_column('%ssession_csrf_token' % TABLE_PREFIX, 'period')
+        # Adding index on 'Token', fields ['owner', 'value', 'for_view', 'created']
+        db.create_index('%ssession_csrf_token' % TABLE_PREFIX, ['owner_id', 'value', 'for_view', 'created'])
+
+
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'ordering': "('content_type__app_label', 'content_type__model', 'codename')", 'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'session_csrf.token': {
+            'Meta': {'unique_together': "[('owner', 'for_view')]", 'object_name': 'Token', 'index_together': "[('owner', 'value', 'for_view', 'period', 'created')]"},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'for_view': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'owner': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"}),
+            'period': ('django.db.models.fields.IntegerField', [], {'default': '0', 'db_index': 'True'}),
+            'value': ('session_csrf.fields.TokenValueField', [], {'max_length': '32'})
+        }
+    }
+
+    complete_apps = ['session_csrf']
\ No newline at end of file
@@ -1,4 +1,5 @@
 from django.utils.decorators import classonlymethod
+from . import registry
 
 
 class PerViewCsrfMixin(object):
@@ -8,4 +9,4 @@ class PerViewCsrfMixin(object):
     def as_view(cls, *args, **kwargs):
         view = super(PerViewCsrfMixin, cls).as_view(*args, **kwargs)
         view.per_view_csrf = True
-        return view
+        return registry.register(view, registry.get_view_name(cls))
@@ -1,9 +1,31 @@
 from datetime import datetime
-from django.db import models
+import time
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models.signals import post_delete, post_init, post_save
 from django.middleware.csrf import _get_new_csrf_key
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.models import User
-from . import conf
+from django.contrib.auth.signals import user_logged_out
+from .fields import TokenValueField
+from .localcache import LocalCache
+from .utils import bump_user_generation, get_user_generation
+from . import conf, metrics, signals
+
+
+# Django < 1.6 has no atomic blocks:
+atomic = getattr(transaction, 'atomic', None) or transaction.commit_on_success
+
+# Process-local cache of tokens already validated against the database,
+# keyed by (owner id, value, for view):
+valid_tokens = LocalCache(conf.CSRF_TOKEN_CACHE_SIZE)
+
+
+def get_period(timestamp=None):
+    """Get issue period of timestamp, periods are CSRF_TOKEN_LIFETIME long,
+    so valid tokens are only in the current and the previous periods"""
+    if timestamp is None:
+        timestamp = time.time()
+    return int(timestamp // conf.CSRF_TOKEN_LIFETIME.total_seconds())
 
 
 class TokenManager(models.Manager):
@@ -13,21 +35,203 @@ class TokenManager(models.Manager):
     def _expiration_date(self):
         return datetime.now() - conf.CSRF_TOKEN_LIFETIME
 
+    @property
+    def _first_valid_period(self):
+        return get_period(
+            time.time() - conf.CSRF_TOKEN_LIFETIME.total_seconds())
+
+    def _get_views_expiration_date(self, owner):
+        """Per-view tokens of owner created before it are expired, it's
+        moved forward when tokens of owner are revoked"""
+        return max(self._expiration_date,
+                   datetime.fromtimestamp(get_user_generation(owner)))
+
+    def _filter_valid(self, expiration_date=None, **kwargs):
+        return self.filter(
+            period__gte=self._first_valid_period,
+            created__gte=expiration_date or self._expiration_date,
+            **kwargs)
+
     def get_expired(self):
         """Get expired tokens"""
         return self.filter(created__lt=self._expiration_date)
 
+    def delete_expired(self, batch_size, after=0):
+        """Delete batch of expired tokens with primary key greater than
+        `after`, returns amount of deleted tokens and the last primary key"""
+        pks = list(self.get_expired().filter(pk__gt=after).order_by(
+            'pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return 0, after
+        self.filter(pk__in=pks).delete()
+        return len(pks), pks[-1]
+
+    def delete_expired_periods(self):
+        """Delete whole periods older than the previous one with one
+        statement for each period, returns amount of deleted tokens"""
+        periods = self.filter(
+            period__lt=self._first_valid_period,
+        ).order_by('period').values_list('period', flat=True).distinct()
+        connection = connections[self.db]
+        sql = 'DELETE FROM {} WHERE {} = %s'.format(
+            connection.ops.quote_name(self.model._meta.db_table),
+            connection.ops.quote_name(
+                self.model._meta.get_field('period').column))
+        deleted = 0
+        cursor = connection.cursor()
+        for period in list(periods):
+            cursor.execute(sql, [period])
+            deleted += cursor.rowcount
+            if not hasattr(transaction, 'atomic'):
+                transaction.commit_unless_managed(using=self.db)
+        return deleted
+
+    def _get_valid_for_views(self, owner, views, expiration_date):
+        return dict(self._filter_valid(
+            expiration_date, owner=owner, for_view__in=views,
+        ).values_list('for_view', 'value'))
+
+    def _get_upsert_sql(self, connection, rows):
+        """Get statement that inserts tokens or replaces expired ones and
+        is the statement returns written tokens, None when the database
+        doesn't support upserts"""
+        meta = self.model._meta
+        table = connection.ops.quote_name(meta.db_table)
+        columns = dict((name, connection.ops.quote_name(
+            meta.get_field(name).column))
+            for name in ('value', 'owner', 'created', 'period', 'for_view'))
+        insert = 'INSERT INTO {} ' \
+                 '({value}, {owner}, {created}, {period}, {for_view}) ' \
+                 'VALUES {}'.format(
+                     table, ', '.join(['(%s, %s, %s, %s, %s)'] * rows),
+                     **columns)
+        if connection.vendor == 'mysql':
+            # Assignments are applied in order, so `created` is checked
+            # before it's changed:
+            return insert + (
+                ' ON DUPLICATE KEY UPDATE'
+                ' {value} = IF({created} < %s, VALUES({value}), {value}),'
+                ' {period} = IF({created} < %s, VALUES({period}),'
+                ' {period}),'
+                ' {created} = IF({created} < %s, VALUES({created}),'
+                ' {created})'.format(**columns)), 3, False
+        if connection.vendor == 'sqlite':
+            version = connection.Database.sqlite_version_info
+            if version < (3, 24):
+                return None, 0, False
+            returning = version >= (3, 35)
+        elif connection.vendor == 'postgresql':
+            returning = True
+        else:
+            return None, 0, False
+        sql = insert + (
+            ' ON CONFLICT ({owner}, {for_view}) DO UPDATE'
+            ' SET {value} = excluded.{value},'
+            ' {created} = excluded.{created},'
+            ' {period} = excluded.{period}'
+            ' WHERE {table}.{created} < %s'.format(table=table, **columns))
+        if returning:
+            sql += ' RETURNING {for_view}, {value}'.format(**columns)
+        return sql, 1, returning
+
+    def _upsert_for_views(self, owner, new, expiration_date):
+        """Insert new tokens for views or rotate expired ones in place with
+        one statement, returns written tokens or None when they should be
+        selected again"""
+        connection = connections[self.db]
+        sql, expirations, returning = self._get_upsert_sql(
+            connection, len(new))
+        if sql is None:
+            return self._rotate_for_views(owner, new, expiration_date)
+        created_field = self.model._meta.get_field('created')
+        now = datetime.now()
+        period = get_period(time.mktime(now.timetuple()))
+        now = created_field.get_db_prep_value(now, connection)
+        expiration = created_field.get_db_prep_value(
+            expiration_date, connection)
+        params = []
+        for view in sorted(new):
+            params.extend([new[view], owner.pk, now, period, view])
+        params.extend([expiration] * expirations)
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        tokens = dict(cursor.fetchall()) if returning else None
+        if not hasattr(transaction, 'atomic'):
+            # Django < 1.6 doesn't autocommit raw queries
+            transaction.commit_unless_managed(using=self.db)
+        return tokens
+
+    def _rotate_for_views(self, owner, new, expiration_date):
+        """Portable and slower version of the upsert"""
+        for view in sorted(new):
+            rotated = self.filter(
+                owner=owner, for_view=view,
+                created__lt=expiration_date,
+            ).update(value=new[view], created=datetime.now(),
+                     period=get_period())
+            if not rotated:
+                try:
+                    with atomic(using=self.db):
+                        self.create(owner=owner, for_view=view,
+                                    value=new[view])
+                except IntegrityError:
+                    # Created concurrently
+                    pass
+
+    def issue_for_views(self, owner, views, created=None):
+        """Get values of valid tokens for views, there's only one token for
+        each view and user, missing or expired tokens are written with one
+        statement, tokens created before revocation are expired. Views with
+        tokens written by this call are added to `created` set"""
+        expiration_date = self._get_views_expiration_date(owner)
+        tokens = self._get_valid_for_views(owner, views, expiration_date)
+        new = dict((view, _get_new_csrf_key())
+                   for view in set(views) - set(tokens))
+        if new:
+            written = self._upsert_for_views(owner, new, expiration_date)
+            if written is not None:
+                tokens.update(written)
+            # Tokens that were written concurrently:
+            missing = set(new) - set(tokens)
+            if missing:
+                tokens.update(self._get_valid_for_views(
+                    owner, missing, expiration_date))
+            if created is not None:
+                # Tokens written concurrently have other random values:
+                created.update(view for view, value in new.items()
+                               if tokens[view] == value)
+        return tokens
+
+    def get_issued(self, owner, value, for_view=None):
+        """Get issue timestamp of valid token, None when there's no token"""
+        key = (owner.pk, value, for_view)
+        started = time.time()
+        issued = valid_tokens.get(key)
+        if valid_tokens.enabled:
+            signals.token_cache_checked.send(
+                sender=self.model, hit=issued is not None,
+                duration=time.time() - started)
+        if issued is not None:
+            return issued
+        created = self._filter_valid(
+            owner=owner, value=value, for_view=for_view,
+        ).values_list('created', flat=True)[:1]
+        if not created:
+            return None
+        issued = time.mktime(created[0].timetuple()) \
+            + created[0].microsecond / 1e6
+        valid_tokens.set(
+            key, issued, issued + conf.CSRF_TOKEN_LIFETIME.total_seconds())
+        return issued
+
     def has_valid(self, owner, value, for_view=None):
         """Has valid token with user and value"""
-        return self.filter(
-            owner=owner, value=value, for_view=for_view,
-            created__gte=self._expiration_date,
-        ).exists()
+        return self.get_issued(owner, value, for_view) is not None
 
 
 class Token(models.Model):
     """Storage for csrf tokens"""
-    value = models.CharField(max_length=32, verbose_name=_('token value'))
+    value = TokenValueField(verbose_name=_('token value'))
     owner = models.ForeignKey(User, verbose_name=_('owner'))
     created = models.DateTimeField(
         auto_now_add=True, verbose_name=_('created'),
@@ -36,14 +240,63 @@ class Token(models.Model):
         null=True, blank=True,
         max_length=255, verbose_name=_('for view'),
     )
+    period = models.IntegerField(
+        default=get_period, db_index=True, verbose_name=_('period'),
+    )
 
     objects = TokenManager()
 
+    class Meta:
+        # Covers the lookup in `TokenManager.has_valid`:
+        index_together = [('owner', 'value', 'for_view', 'period', 'created')]
+        # Per-view tokens are rotated in place, main tokens have NULL view:
+        unique_together = [('owner', 'for_view')]
+
     def save(self, *args, **kwargs):
-        """Generate token on first save"""
-        if not self.id:
+        """Generate token on first save when value isn't set"""
+        if not self.id and not self.value:
             self.value = _get_new_csrf_key()
         return super(Token, self).save(*args, **kwargs)
 
     def __unicode__(self):
         return '{}:{}'.format(self.owner, self.created)
+
+
+def invalidate_cached_token(sender, instance, **kwargs):
+    """Remove deleted or changed token from the validated tokens cache"""
+    valid_tokens.delete((instance.owner_id, instance.value, instance.for_view))
+
+
+if valid_tokens.enabled:
+    post_save.connect(invalidate_cached_token, sender=Token)
+    post_delete.connect(invalidate_cached_token, sender=Token)
+
+
+def revoke_on_logout(sender, user, **kwargs):
+    """Revoke tokens of logged out user"""
+    if user is not None:
+        bump_user_generation(user)
+
+
+def remember_password(sender, instance, **kwargs):
+    instance._csrf_password = instance.password
+
+
+def revoke_on_password_change(sender, instance, created, **kwargs):
+    """Revoke tokens of user when password is changed"""
+    if not created and instance.password != instance._csrf_password:
+        bump_user_generation(instance)
+    instance._csrf_password = instance.password
+
+
+user_logged_out.connect(revoke_on_logout)
+post_init.connect(remember_password, sender=User)
+post_save.connect(revoke_on_password_change, sender=User)
+
+
+if conf.CSRF_METRICS:
+    metrics.collector.connect()
+
+
+# Registers system checks:
+from . import checks  # NOQA
@@ -0,0 +1,48 @@
+import hashlib
+
+
+# Registered per-view csrf views, canonical name -> view id:
+_views = {}
+# View ids of all names seen, registered or not:
+_ids = {}
+# Names used by compiled templates:
+_used_names = set()
+
+
+def get_view_name(view):
+    """Get canonical name of view"""
+    return '{}.{}'.format(view.__module__, view.__name__)
+
+
+def get_view_id(name):
+    """Get compact stable id of view name, stored with per-view tokens"""
+    try:
+        return _ids[name]
+    except KeyError:
+        view_id = hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+        _ids[name] = view_id
+        return view_id
+
+
+def register(view, name=None):
+    """Register view that requires per-view csrf token, the view id is
+    stored on the view"""
+    if name is None:
+        name = get_view_name(view)
+    view.per_view_csrf_id = _views[name] = get_view_id(name)
+    return view
+
+
+def use(name):
+    """Get view id of name used in a template"""
+    _used_names.add(name)
+    return get_view_id(name)
+
+
+def is_registered(name):
+    return name in _views
+
+
+def get_unknown_names():
+    """Get names used in templates without registered views"""
+    return sorted(name for name in _used_names if name not in _views)
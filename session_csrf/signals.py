@@ -0,0 +1,20 @@
+from django.dispatch import Signal
+
+
+# Process-local cache of validated tokens was checked, `hit` is a bool and
+# `duration` is in seconds:
+token_cache_checked = Signal(providing_args=['hit', 'duration'])
+
+# Token was checked in the backend, `duration` is in seconds:
+token_validated = Signal(
+    providing_args=['user', 'for_view', 'valid', 'duration'])
+
+# Tokens were issued by the backend, `views` has None for the main token:
+tokens_issued = Signal(providing_args=['user', 'views', 'duration'])
+
+# Anonymous token was read from or stored to the cache:
+anonymous_token_read = Signal(providing_args=['found', 'duration'])
+anonymous_token_stored = Signal(providing_args=['duration'])
+
+# Request was rejected, `duration` is the time spent on the check:
+request_rejected = Signal(providing_args=['request', 'reason', 'duration'])
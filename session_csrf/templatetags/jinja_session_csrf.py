@@ -1,7 +1,8 @@
 from jinja2 import nodes
 from coffin.template.defaulttags import CsrfTokenExtension
 from coffin import template
-from ..utils import get_token_for_request
+from ..utils import get_tokens_for_request
+from .. import registry
 
 
 register = template.Library()
@@ -17,17 +18,31 @@ class PerViewCSRFExtension(CsrfTokenExtension):
         """Parse tokens from template"""
         lineno = parser.stream.next().lineno
         view_name = parser.parse_expression()
+        # Shared by all per_view_csrf tags of the template, the list is
+        # complete when the template is compiled:
+        if not hasattr(parser, 'per_view_csrf_ids'):
+            parser.per_view_csrf_ids = []
+        if isinstance(view_name, nodes.Const):
+            view_id = nodes.Const(registry.use(view_name.value))
+            parser.per_view_csrf_ids.append(view_id.value)
+        else:
+            view_id = self.call_method('_get_view_id', [view_name])
         return nodes.Output([
             self.call_method('_render', [
                 nodes.Name('csrf_token', 'load'),
-                view_name,
+                view_id,
                 nodes.Name('request', 'load'),
+                nodes.Const(parser.per_view_csrf_ids),
             ]),
         ]).set_lineno(lineno)
 
-    def _render(self, csrf_token, view_name, request):
+    def _get_view_id(self, view_name):
+        return registry.get_view_id(view_name)
+
+    def _render(self, csrf_token, view_id, request, template_view_ids):
         """Render csrf token"""
-        token = get_token_for_request(request, view_name)
-        if token is not None:
-            csrf_token = token.value
+        tokens = get_tokens_for_request(
+            request, template_view_ids + [view_id])
+        if tokens is not None:
+            csrf_token = tokens[view_id]
         return super(PerViewCSRFExtension, self)._render(csrf_token)
@@ -1,17 +1,49 @@
 from django.template.defaulttags import CsrfTokenNode
 from django import template
-from ..utils import save_token, get_token_for_request
+from django.utils import six
+from ..utils import save_token, get_tokens_for_request
+from .. import registry
 
 
 register = template.Library()
 
 
-@register.simple_tag(takes_context=True)
-def per_view_csrf(context, view_name):
+class PerViewCsrfNode(template.Node):
+    """Renders per view csrf token, tokens for all views with literal names
+    in the template are resolved together"""
+
+    def __init__(self, view_name, view_id, template_view_ids):
+        self.view_name = view_name
+        self.view_id = view_id
+        self.template_view_ids = template_view_ids
+
+    def render(self, context):
+        view_id = self.view_id
+        if view_id is None:
+            view_id = registry.get_view_id(self.view_name.resolve(context))
+        with save_token(context):
+            tokens = get_tokens_for_request(
+                context['request'],
+                self.template_view_ids + [view_id],
+            )
+            if tokens is not None:
+                context['csrf_token'] = tokens[view_id]
+            return CsrfTokenNode().render(context)
+
+
+@register.tag
+def per_view_csrf(parser, token):
     """Register per view csrf token. Not pure!"""
-    with save_token(context):
-        token = get_token_for_request(context['request'], view_name)
-        if token is not None:
-            context['csrf_token'] = token.value
-        return CsrfTokenNode().render(context)
-per_view_csrf.is_safe = True
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(
+            '{} tag requires view name'.format(bits[0]))
+    view_name = parser.compile_filter(bits[1])
+    # Shared by all per_view_csrf tags of the template:
+    if not hasattr(parser, 'per_view_csrf_ids'):
+        parser.per_view_csrf_ids = []
+    view_id = None
+    if isinstance(view_name.var, six.string_types) and not view_name.filters:
+        view_id = registry.use(view_name.var)
+        parser.per_view_csrf_ids.append(view_id)
+    return PerViewCsrfNode(view_name, view_id, parser.per_view_csrf_ids)
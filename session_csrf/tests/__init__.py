@@ -1,6 +1,14 @@
 from .base import urlpatterns
+from .test_backends import *
+from .test_caches import *
+from .test_checks import *
 from .test_middlewares import *
+from .test_commands import *
 from .test_decorators import *
+from .test_localcache import *
+from .test_metrics import *
 from .test_models import *
+from .test_queries import *
+from .test_signals import *
 from .test_templatetags import *
 from .test_utils import *
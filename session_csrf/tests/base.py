@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta
+import time
 import django.test.client
 try:
     from django.conf.urls import patterns
@@ -8,8 +9,13 @@ from django import http
 from django.contrib.auth import logout
 from django.core import signals
 from django.core.handlers.wsgi import WSGIRequest
-from django.db import close_connection
+try:
+    from django.db import close_old_connections
+except ImportError:
+    # Django < 1.6 closes connections only when request is finished
+    from django.db import close_connection as close_old_connections
 from ..decorators import anonymous_csrf, anonymous_csrf_exempt, per_view_csrf
+from ..models import get_period
 from .. import conf
 
 
@@ -18,9 +24,14 @@ def per_view(request):
     return http.HttpResponse()
 
 
+def token(request):
+    return http.HttpResponse(request.csrf_token)
+
+
 urlpatterns = patterns('',
     ('^$', lambda r: http.HttpResponse()),
-    ('^anon$', anonymous_csrf(lambda r: http.HttpResponse())),
+    ('^token$', token),
+    ('^anon$', anonymous_csrf(token)),
     ('^no-anon-csrf$', anonymous_csrf_exempt(lambda r: http.HttpResponse())),
     ('^logout$', anonymous_csrf(lambda r: logout(r) or http.HttpResponse())),
     ('^per-view$', per_view)
@@ -31,6 +42,7 @@ def make_expired(token):
     """Make token expired"""
     token.created =\
         datetime.now() - conf.CSRF_TOKEN_LIFETIME - timedelta(days=1)
+    token.period = get_period(time.mktime(token.created.timetuple()))
     token.save()
     return token
 
@@ -48,7 +60,9 @@ class ClientHandler(django.test.client.ClientHandler):
         if self._request_middleware is None:
             self.load_middleware()
 
+        signals.request_started.disconnect(close_old_connections)
         signals.request_started.send(sender=self.__class__)
+        signals.request_started.connect(close_old_connections)
         try:
             request = WSGIRequest(environ)
             # sneaky little hack so that we can easily get round
@@ -58,9 +72,9 @@ class ClientHandler(django.test.client.ClientHandler):
             request._dont_enforce_csrf_checks = not self.enforce_csrf_checks
             response = self.get_response(request)
         finally:
-            signals.request_finished.disconnect(close_connection)
+            signals.request_finished.disconnect(close_old_connections)
             signals.request_finished.send(sender=self.__class__)
-            signals.request_finished.connect(close_connection)
+            signals.request_finished.connect(close_old_connections)
 
         # Store the request object.
         response._request = request
@@ -0,0 +1,218 @@
+from datetime import timedelta
+import time
+import mock
+from unittest import skipIf
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+from ..backends import get_backend, load_backend
+from ..backends.cache import CacheBackend
+from ..backends.db import DatabaseBackend
+from ..backends.redis_backend import RedisBackend
+from ..backends.signed import SignedBackend
+from ..models import Token
+from .. import conf
+from .base import make_expired
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class BackendTestMixin(object):
+    """Tests that every token backend should pass"""
+    backend_class = None
+
+    def setUp(self):
+        cache.clear()
+        self.backend = self.backend_class()
+        self._user = User.objects.create_user('test', 'test@test.test', 'test')
+
+    def test_valid_for_owner(self):
+        """Test token is valid for owner"""
+        token = self.backend.issue(self._user)
+        self.assertTrue(self.backend.validate(self._user, token))
+
+    def test_get_issue_time(self):
+        """Test get issue time of valid token"""
+        started = int(time.time())
+        token = self.backend.issue(self._user)
+        issued = self.backend.get_issued(self._user, token)
+        self.assertGreaterEqual(issued, started - 1)
+        self.assertLessEqual(issued, time.time())
+        self.assertIsNone(self.backend.get_issued(self._user, 'a' * 32))
+
+    def test_not_valid_for_another_user(self):
+        """Test token is not valid for another user"""
+        token = self.backend.issue(self._user)
+        user = User.objects.create_user('another', 'a@test.test', 'test')
+        self.assertFalse(self.backend.validate(user, token))
+
+    def test_not_valid_when_unknown(self):
+        """Test unknown token is not valid"""
+        self.assertFalse(self.backend.validate(self._user, 'a' * 32))
+        self.assertFalse(self.backend.validate(self._user, ''))
+
+    def test_valid_for_view(self):
+        """Test token is valid only for its view"""
+        token = self.backend.issue(self._user, 'test')
+        self.assertTrue(self.backend.validate(self._user, token, 'test'))
+        self.assertFalse(self.backend.validate(self._user, token, 'another'))
+        self.assertFalse(self.backend.validate(self._user, token))
+
+    def test_issue_many(self):
+        """Test issue tokens for many views"""
+        tokens = self.backend.issue_many(self._user, ['first', 'second'])
+        self.assertItemsEqual(tokens, ['first', 'second'])
+        for view, token in tokens.items():
+            self.assertTrue(self.backend.validate(self._user, token, view))
+
+    def test_purge_expired(self):
+        """Test purge expired keeps valid tokens"""
+        token = self.backend.issue(self._user)
+        self.backend.purge_expired()
+        self.assertTrue(self.backend.validate(self._user, token))
+
+
+class RevocableBackendTestMixin(BackendTestMixin):
+    """Tests for backends that can revoke tokens"""
+
+    def test_issue_new_tokens(self):
+        """Test issue new token every time"""
+        self.assertNotEqual(self.backend.issue(self._user),
+                            self.backend.issue(self._user))
+
+    def test_issue_many_reuses_tokens(self):
+        """Test issue many reuses valid tokens for views"""
+        token = self.backend.issue(self._user, 'first')
+        created = set()
+        tokens = self.backend.issue_many(
+            self._user, ['first', 'second'], created)
+        self.assertEqual(tokens['first'], token)
+        self.assertEqual(created, set(['second']))
+
+    def test_revoke(self):
+        """Test revoked token is not valid"""
+        token = self.backend.issue(self._user)
+        self.backend.revoke(self._user, token)
+        self.assertFalse(self.backend.validate(self._user, token))
+
+    def test_reuse_token_for_view(self):
+        """Test reuse valid token for view"""
+        self.assertEqual(self.backend.issue(self._user, 'test'),
+                         self.backend.issue(self._user, 'test'))
+
+    def test_revoke_token_for_view(self):
+        """Test revoked token for view is not reused"""
+        token = self.backend.issue(self._user, 'test')
+        self.backend.revoke(self._user, token, 'test')
+        self.assertFalse(self.backend.validate(self._user, token, 'test'))
+        self.assertNotEqual(self.backend.issue(self._user, 'test'), token)
+
+
+class DatabaseBackendCase(RevocableBackendTestMixin, TestCase):
+    """Database backend test case"""
+    backend_class = DatabaseBackend
+
+    def test_purge_expired_tokens(self):
+        """Test purge expired tokens"""
+        token = make_expired(Token.objects.get(
+            value=self.backend.issue(self._user)))
+        self.backend.purge_expired()
+        self.assertFalse(Token.objects.filter(pk=token.pk).exists())
+
+
+class CacheBackendCase(RevocableBackendTestMixin, TestCase):
+    """Cache backend test case"""
+    backend_class = CacheBackend
+
+    def test_not_query_database(self):
+        """Test cache backend don't touch database"""
+        with self.assertNumQueries(0):
+            token = self.backend.issue(self._user, 'test')
+            self.backend.validate(self._user, token, 'test')
+
+
+@skipIf(fakeredis is None, 'fakeredis is not installed')
+class RedisBackendCase(RevocableBackendTestMixin, TestCase):
+    """Redis backend test case"""
+
+    def backend_class(self):
+        client = fakeredis.FakeStrictRedis()
+        client.flushall()
+        return RedisBackend(client)
+
+    def _field(self, token, for_view=None):
+        return self.backend._token_field(token, for_view)
+
+    def test_one_hash_for_user(self):
+        """Test main and per-view tokens stored in one expiring hash"""
+        self.backend.issue(self._user)
+        self.backend.issue_many(self._user, ['first', 'second'])
+        key = self.backend._key(self._user)
+        self.assertEqual(self.backend.client.keys('*'), [key.encode()])
+        self.assertEqual(self.backend.client.hlen(key), 5)
+        self.assertGreater(self.backend.client.ttl(key), 0)
+
+    def test_not_valid_when_expired(self):
+        """Test expired token is not valid and not reused"""
+        token = self.backend.issue(self._user, 'test')
+        with mock.patch('time.time', return_value=time.time() + 2 * 86400):
+            self.assertFalse(self.backend.validate(self._user, token, 'test'))
+            self.assertNotEqual(self.backend.issue(self._user, 'test'), token)
+
+    def test_purge_expired_fields(self):
+        """Test purge expired fields of the hash"""
+        token = self.backend.issue(self._user)
+        key = self.backend._key(self._user)
+        self.backend.client.hset(key, self._field('expired'), 0)
+        self.backend.purge_expired()
+        self.assertEqual(self.backend.client.hkeys(key),
+                         [self._field(token).encode()])
+
+
+class SignedBackendCase(BackendTestMixin, TestCase):
+    """Signed backend test case"""
+    backend_class = SignedBackend
+
+    def test_not_valid_when_tampered(self):
+        """Test token is not valid when tampered"""
+        token = self.backend.issue(self._user)
+        self.assertFalse(self.backend.validate(self._user, token[:-1]))
+
+    def test_not_valid_when_expired(self):
+        """Test token is not valid when expired"""
+        token = self.backend.issue(self._user)
+        with mock.patch.object(conf, 'CSRF_TOKEN_LIFETIME', timedelta(-1)):
+            self.assertFalse(self.backend.validate(self._user, token))
+
+    def test_not_query_database(self):
+        """Test signed backend don't touch database"""
+        with self.assertNumQueries(0):
+            token = self.backend.issue(self._user)
+            self.backend.validate(self._user, token)
+
+    def test_revoke_does_nothing(self):
+        """Test revoke is a no-op, token stays valid until it expires"""
+        token = self.backend.issue(self._user)
+        self.backend.revoke(self._user, token)
+        self.assertTrue(self.backend.validate(self._user, token))
+
+
+class GetBackendCase(TestCase):
+    """get_backend test case"""
+
+    def test_get_configured_backend(self):
+        """Test get backend from setting"""
+        with mock.patch.object(
+            conf, 'CSRF_TOKEN_BACKEND',
+            'session_csrf.backends.cache.CacheBackend',
+        ):
+            self.assertIsInstance(get_backend(), CacheBackend)
+        self.assertIsInstance(get_backend(), DatabaseBackend)
+
+    def test_raise_on_wrong_path(self):
+        """Test raise when backend can't be loaded"""
+        with self.assertRaises(ImproperlyConfigured):
+            load_backend('session_csrf.backends.Wrong')
@@ -0,0 +1,73 @@
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+import mock
+from ..caches import ShardedCache, get_csrf_cache
+from ..utils import prep_key
+from .. import caches, conf
+
+
+class ShardedCacheCase(TestCase):
+    """Consistent hashing of keys between caches test case"""
+
+    def setUp(self):
+        self.shards = dict(
+            (name, LocMemCache('sharded-{}'.format(name), {}))
+            for name in ('a', 'b', 'c'))
+        for shard in self.shards.values():
+            shard.clear()
+        self.cache = ShardedCache(self.shards)
+        self.keys = [prep_key(str(n)) for n in range(300)]
+
+    def test_spread_keys(self):
+        """Test spread keys between all caches"""
+        for key in self.keys:
+            self.cache.set(key, key)
+        for shard in self.shards.values():
+            stored = [key for key in self.keys if shard.get(key) == key]
+            self.assertGreater(len(stored), len(self.keys) / 6)
+
+    def test_same_cache_for_key(self):
+        """Test key is stored and read from one cache"""
+        self.cache.set('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertFalse(self.cache.add('key', 'other'))
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_many(self):
+        """Test get and set many keys from different caches"""
+        data = dict((key, key) for key in self.keys[:20])
+        self.cache.set_many(data)
+        self.assertEqual(self.cache.get_many(self.keys[:20]), data)
+        self.cache.delete_many(self.keys[:20])
+        self.assertEqual(self.cache.get_many(self.keys[:20]), {})
+
+    def test_move_part_of_keys_when_cache_added(self):
+        """Test adding cache moves only a part of keys"""
+        before = dict((key, self.cache.get_cache(key)) for key in self.keys)
+        self.shards['d'] = LocMemCache('sharded-d', {})
+        after = ShardedCache(self.shards)
+        moved = [key for key in self.keys
+                 if after.get_cache(key) is not before[key]]
+        self.assertLess(len(moved), len(self.keys) / 2)
+        for key in moved:
+            self.assertIs(after.get_cache(key), self.shards['d'])
+
+
+class GetCsrfCacheCase(TestCase):
+    """get_csrf_cache test case"""
+
+    def tearDown(self):
+        caches._caches.clear()
+
+    def test_default_cache(self):
+        """Test use default cache by default"""
+        get_csrf_cache().set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+
+    def test_sharded_cache(self):
+        """Test shard keys for list of aliases"""
+        with mock.patch.object(conf, 'CSRF_CACHE_ALIAS',
+                               ['default', 'default']):
+            self.assertIsInstance(get_csrf_cache(), ShardedCache)
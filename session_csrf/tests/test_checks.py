@@ -0,0 +1,39 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.template import Template
+from django.test import TestCase
+from django.utils.six import StringIO
+from ..checks import get_unknown_view_names
+from .base import per_view
+
+
+class CheckPerViewCsrfCase(TestCase):
+    """Unknown per-view csrf view names check test case"""
+
+    def test_registered_view(self):
+        """Test registered view isn't reported"""
+        Template('{% load session_csrf %}'
+                 '{% per_view_csrf "session_csrf.tests.base.per_view" %}')
+        self.assertNotIn('session_csrf.tests.base.per_view',
+                         get_unknown_view_names())
+
+    def test_unknown_view(self):
+        """Test unknown view name is reported"""
+        Template('{% load session_csrf %}{% per_view_csrf "app.unknown" %}')
+        self.assertIn('app.unknown', get_unknown_view_names())
+
+    def test_precompute_view_id(self):
+        """Test decorated view has precomputed view id"""
+        node = Template(
+            '{% load session_csrf %}'
+            '{% per_view_csrf "session_csrf.tests.base.per_view" %}',
+        ).nodelist[-1]
+        self.assertEqual(node.view_id, per_view.per_view_csrf_id)
+
+    def test_command(self):
+        """Test command fails with unknown view names"""
+        Template('{% load session_csrf %}{% per_view_csrf "app.unknown" %}')
+        err = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('check_per_view_csrf', stderr=err)
+        self.assertIn('app.unknown', err.getvalue())
@@ -0,0 +1,57 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+from ..models import Token
+from .base import make_expired
+
+
+class PurgeExpiredCsrfTokensCase(TestCase):
+    """purge_expired_csrf_tokens command test case"""
+
+    def setUp(self):
+        self._user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.valid = [Token.objects.create(owner=self._user)
+                      for _ in range(3)]
+        self.expired = [make_expired(Token.objects.create(owner=self._user))
+                        for _ in range(5)]
+
+    def _call(self, **options):
+        out = StringIO()
+        call_command('purge_expired_csrf_tokens', stdout=out, **options)
+        return out.getvalue()
+
+    def test_delete_expired_tokens(self):
+        """Test delete only expired tokens"""
+        out = self._call(batch_size=2)
+        self.assertItemsEqual(Token.objects.all(), self.valid)
+        self.assertIn('Deleted 5 expired tokens', out)
+
+    def test_delete_in_batches(self):
+        """Test delete tokens in batches"""
+        out = self._call(batch_size=2, verbosity=2)
+        self.assertEqual(out.count('Deleted 2 tokens'), 2)
+        self.assertEqual(out.count('Deleted 1 tokens'), 1)
+
+    def test_resume_after_primary_key(self):
+        """Test resume after primary key"""
+        self._call(start_after=self.expired[1].pk)
+        self.assertItemsEqual(Token.objects.all(),
+                              self.valid + self.expired[:2])
+
+    def test_delete_expired_batch(self):
+        """Test delete batch of expired tokens"""
+        deleted, last_pk = Token.objects.delete_expired(3)
+        self.assertEqual(deleted, 3)
+        self.assertEqual(last_pk, self.expired[2].pk)
+        self.assertEqual(Token.objects.delete_expired(3, last_pk),
+                         (2, self.expired[-1].pk))
+        self.assertEqual(Token.objects.delete_expired(3, last_pk),
+                         (0, last_pk))
+
+    def test_drop_old_periods(self):
+        """Test drop whole old periods"""
+        out = self._call(by_period=True, verbosity=2)
+        self.assertItemsEqual(Token.objects.all(), self.valid)
+        self.assertIn('Deleted 5 tokens of old periods', out)
+        self.assertIn('Deleted 5 expired tokens', out)
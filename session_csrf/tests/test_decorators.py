@@ -1,11 +1,13 @@
+import time
 import mock
 import django.test
 from django.core.cache import cache
 from django.contrib.sessions.models import Session
 from django.contrib.auth.models import User
+from ..localcache import LocalCache
 from ..utils import prep_key
 from ..decorators import per_view_csrf
-from .. import conf
+from .. import anonymous, conf
 from .base import ClientHandler
 
 
@@ -53,7 +55,8 @@ class TestAnonymousCsrf(django.test.TestCase):
         response = self.client.get('/anon')
         # Get the key from the cookie and find the token in the cache.
         key = response.cookies[conf.ANON_COOKIE].value
-        self.assertEqual(response._request.csrf_token, cache.get(prep_key(key)))
+        self.assertEqual(response._request.csrf_token,
+                         cache.get(prep_key(key))[0])
 
     def test_existing_anon_cookie_on_request(self):
         # We reuse an existing anon cookie key+token.
@@ -61,8 +64,9 @@ class TestAnonymousCsrf(django.test.TestCase):
         key = response.cookies[conf.ANON_COOKIE].value
         # Now check that subsequent requests use that cookie.
         response = self.client.get('/anon')
-        self.assertEqual(response.cookies[conf.ANON_COOKIE].value, key)
-        self.assertEqual(response._request.csrf_token, cache.get(prep_key(key)))
+        self.assertEqual(self.client.cookies[conf.ANON_COOKIE].value, key)
+        self.assertEqual(response._request.csrf_token,
+                         cache.get(prep_key(key))[0])
 
     def test_new_anon_token_on_response(self):
         # The anon cookie is sent and we vary on Cookie.
@@ -71,14 +75,33 @@ class TestAnonymousCsrf(django.test.TestCase):
         self.assertEqual(response['Vary'], 'Cookie')
 
     def test_existing_anon_token_on_response(self):
-        # The anon cookie is sent and we vary on Cookie, reusing the old value.
+        # The anon cookie isn't sent again until it should be refreshed,
+        # but we still vary on Cookie.
+        self.client.get('/anon')
+        with mock.patch('time.time', return_value=time.time() + 60):
+            response = self.client.get('/anon')
+        self.assertNotIn(conf.ANON_COOKIE, response.cookies)
+        self.assertEqual(response['Vary'], 'Cookie')
+
+    def test_refresh_anon_token(self):
+        # The anon cookie and token are refreshed after a part of timeout.
         response = self.client.get('/anon')
         key = response.cookies[conf.ANON_COOKIE].value
+        token = response._request.csrf_token
+        later = time.time() + conf.ANON_TIMEOUT * conf.ANON_REFRESH_RATIO
+        with mock.patch('time.time', return_value=later):
+            response = self.client.get('/anon')
+        self.assertEqual(response.cookies[conf.ANON_COOKIE].value, key)
+        self.assertEqual(response._request.csrf_token, token)
+        self.assertEqual(cache.get(prep_key(key)), (token, later))
 
+    def test_refresh_legacy_anon_token(self):
+        # Tokens stored without refresh time are refreshed.
+        cache.set(prep_key(self.token), 'woo')
+        self.client.cookies[conf.ANON_COOKIE] = self.token
         response = self.client.get('/anon')
-        self.assertEqual(response.cookies[conf.ANON_COOKIE].value, key)
-        self.assertIn(conf.ANON_COOKIE, response.cookies)
-        self.assertEqual(response['Vary'], 'Cookie')
+        self.assertEqual(response._request.csrf_token, 'woo')
+        self.assertEqual(response.cookies[conf.ANON_COOKIE].value, self.token)
 
     def test_anon_csrf_logout(self):
         # Beware of views that logout the user.
@@ -125,7 +148,7 @@ class TestAnonAlways(django.test.TestCase):
     def test_csrftoken_unauthenticated(self):
         # request.csrf_token is set for anonymous users
         # when ANON_ALWAYS is enabled.
-        response = self.client.get('/', follow=True)
+        response = self.client.get('/token', follow=True)
         # The CSRF token is a 32-character MD5 string.
         self.assertEqual(len(response._request.csrf_token), 32)
 
@@ -133,7 +156,7 @@ class TestAnonAlways(django.test.TestCase):
         # Nothing special happens, nothing breaks.
         # Find the CSRF token in the session.
         self.login()
-        response = self.client.get('/', follow=True)
+        response = self.client.get('/token', follow=True)
         sessionid = response.cookies['sessionid'].value
         session = Session.objects.get(session_key=sessionid)
         token = session.get_decoded()['csrf_token']
@@ -148,22 +171,40 @@ class TestAnonAlways(django.test.TestCase):
 
     def test_new_anon_token_on_request(self):
         # A new anon user gets a key+token on the request and response.
-        response = self.client.get('/')
+        response = self.client.get('/token')
         # Get the key from the cookie and find the token in the cache.
         key = response.cookies[conf.ANON_COOKIE].value
-        self.assertEqual(response._request.csrf_token, cache.get(prep_key(key)))
+        self.assertEqual(response._request.csrf_token,
+                         cache.get(prep_key(key))[0])
+
+    def test_not_used_anon_token(self):
+        # The anon cookie isn't set when the token isn't used.
+        response = self.client.get('/')
+        self.assertNotIn(conf.ANON_COOKIE, response.cookies)
+        self.assertFalse(response.has_header('Vary'))
 
     def test_existing_anon_cookie_on_request(self):
         # We reuse an existing anon cookie key+token.
-        response = self.client.get('/')
+        response = self.client.get('/token')
         key = response.cookies[conf.ANON_COOKIE].value
 
         # Now check that subsequent requests use that cookie.
-        response = self.client.get('/')
-        self.assertEqual(response.cookies[conf.ANON_COOKIE].value, key)
-        self.assertEqual(response._request.csrf_token, cache.get(prep_key(key)))
+        response = self.client.get('/token')
+        self.assertEqual(self.client.cookies[conf.ANON_COOKIE].value, key)
+        self.assertNotIn(conf.ANON_COOKIE, response.cookies)
+        self.assertEqual(response._request.csrf_token,
+                         cache.get(prep_key(key))[0])
         self.assertEqual(response['Vary'], 'Cookie')
 
+    def test_refresh_anon_token(self):
+        # The anon cookie is sent again after a part of timeout.
+        response = self.client.get('/token')
+        key = response.cookies[conf.ANON_COOKIE].value
+        later = time.time() + conf.ANON_TIMEOUT * conf.ANON_REFRESH_RATIO
+        with mock.patch('time.time', return_value=later):
+            response = self.client.get('/token')
+        self.assertEqual(response.cookies[conf.ANON_COOKIE].value, key)
+
     def test_anon_csrf_logout(self):
         # Beware of views that logout the user.
         self.login()
@@ -171,12 +212,12 @@ class TestAnonAlways(django.test.TestCase):
         self.assertEqual(response.status_code, 200)
 
     def test_existing_anon_cookie_not_in_cache(self):
-        response = self.client.get('/')
+        response = self.client.get('/token')
         self.assertEqual(len(response._request.csrf_token), 32)
 
         # Clear cache and make sure we still get a token
         cache.clear()
-        response = self.client.get('/')
+        response = self.client.get('/token')
         self.assertEqual(len(response._request.csrf_token), 32)
 
     def test_massive_anon_cookie(self):
@@ -184,18 +225,140 @@ class TestAnonAlways(django.test.TestCase):
         # memcache will cry and you get a warning if you use LocMemCache
         junk = 'x' * 300
         with mock.patch('warnings.warn') as warner:
-            response = self.client.get('/', HTTP_COOKIE='anoncsrf=%s' % junk)
+            response = self.client.get('/token', HTTP_COOKIE='anoncsrf=%s' % junk)
             self.assertEqual(response.status_code, 200)
             self.assertEqual(warner.call_count, 0)
 
     def test_surprising_characters(self):
         c = 'anoncsrf="|dir; multidb_pin_writes=y; sessionid="gAJ9cQFVC'
         with mock.patch('warnings.warn') as warner:
-            response = self.client.get('/', HTTP_COOKIE=c)
+            response = self.client.get('/token', HTTP_COOKIE=c)
             self.assertEqual(response.status_code, 200)
             self.assertEqual(warner.call_count, 0)
 
 
+class TestSignedAnonymousCsrf(django.test.TestCase):
+    # Anonymous tokens in signed cookies
+    urls = 'session_csrf.tests'
+
+    def setUp(self):
+        self.client.handler = ClientHandler(enforce_csrf_checks=True)
+        self.save_ANON_ALWAYS = conf.ANON_ALWAYS
+        self.save_ANON_MODE = conf.ANON_MODE
+        conf.ANON_ALWAYS = False
+        conf.ANON_MODE = 'signed'
+        self.cache = mock.patch('session_csrf.anonymous.get_csrf_cache').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        conf.ANON_ALWAYS = self.save_ANON_ALWAYS
+        conf.ANON_MODE = self.save_ANON_MODE
+
+    def test_new_anon_token_in_cookie(self):
+        # The token is signed in the cookie, the cache isn't used.
+        response = self.client.get('/anon')
+        value = response.cookies[conf.ANON_COOKIE].value
+        self.assertEqual(value.split(':')[0], response._request.csrf_token)
+        self.assertEqual(response['Vary'], 'Cookie')
+        self.assertFalse(self.cache.called)
+
+    def test_existing_anon_cookie_on_request(self):
+        # We reuse the token from the signed cookie.
+        token = self.client.get('/anon')._request.csrf_token
+        response = self.client.get('/anon')
+        self.assertEqual(response._request.csrf_token, token)
+        self.assertNotIn(conf.ANON_COOKIE, response.cookies)
+        self.assertFalse(self.cache.called)
+
+    def test_post_with_anon_token(self):
+        # POST with the token from the signed cookie is accepted.
+        token = self.client.get('/anon')._request.csrf_token
+        response = self.client.post('/anon', HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_token_for_tampered_cookie(self):
+        # Tampered cookie is replaced.
+        self.client.cookies[conf.ANON_COOKIE] = 'woo:1:bad'
+        response = self.client.get('/anon')
+        self.assertNotEqual(response._request.csrf_token, 'woo')
+        self.assertIn(conf.ANON_COOKIE, response.cookies)
+
+    def test_new_token_for_expired_cookie(self):
+        # Expired cookie is replaced.
+        response = self.client.get('/anon')
+        token = response._request.csrf_token
+        later = time.time() + conf.ANON_TIMEOUT + 1
+        with mock.patch('time.time', return_value=later):
+            response = self.client.get('/anon')
+        self.assertNotEqual(response._request.csrf_token, token)
+
+    def test_refresh_anon_cookie(self):
+        # The cookie is signed again after a part of timeout.
+        response = self.client.get('/anon')
+        token = response._request.csrf_token
+        later = time.time() + conf.ANON_TIMEOUT * conf.ANON_REFRESH_RATIO
+        with mock.patch('time.time', return_value=later):
+            response = self.client.get('/anon')
+        self.assertEqual(response._request.csrf_token, token)
+        self.assertIn(conf.ANON_COOKIE, response.cookies)
+
+    def test_anon_always(self):
+        # The middleware uses the signed cookie with ANON_ALWAYS too.
+        conf.ANON_ALWAYS = True
+        token = self.client.get('/token')._request.csrf_token
+        response = self.client.post('/', HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.cache.called)
+
+
+class TestAnonymousLocalCache(django.test.TestCase):
+    """Test process-local cache in front of the shared cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.rf = django.test.RequestFactory()
+        self._patcher = mock.patch.object(
+            anonymous, 'local_tokens', LocalCache(10))
+        self._patcher.start()
+
+    def tearDown(self):
+        self._patcher.stop()
+
+    def _request(self, key):
+        request = self.rf.get('/')
+        request.COOKIES[conf.ANON_COOKIE] = key
+        return request
+
+    def test_write_through_on_issue(self):
+        """Test issued token is read without the shared cache"""
+        key, token, _ = anonymous.issue_token(self.rf.get('/'))
+        with mock.patch.object(anonymous, 'get_csrf_cache') as shared:
+            self.assertEqual(anonymous.get_token(self._request(key))[1], token)
+        self.assertFalse(shared.called)
+
+    def test_cache_shared_hit(self):
+        """Test token from the shared cache is cached locally"""
+        cache.set(prep_key('key'), ('token', time.time()))
+        anonymous.get_token(self._request('key'))
+        with mock.patch.object(anonymous, 'get_csrf_cache') as shared:
+            self.assertEqual(
+                anonymous.get_token(self._request('key'))[1], 'token')
+        self.assertFalse(shared.called)
+
+    def test_not_cache_miss(self):
+        """Test missing token isn't cached locally"""
+        anonymous.get_token(self._request('key'))
+        self.assertEqual(len(anonymous.local_tokens), 0)
+
+    def test_expire_locally(self):
+        """Test local token expires to pick up revocations"""
+        key = anonymous.issue_token(self.rf.get('/'))[0]
+        cache.delete(prep_key(key))
+        later = time.time() + conf.ANON_LOCAL_CACHE_TIMEOUT
+        with mock.patch('time.time', return_value=later):
+            self.assertEqual(anonymous.get_token(self._request(key))[1], '')
+
+
 class PerViewCsrfCase(django.test.TestCase):
     """per_view_csrf test case"""
 
@@ -0,0 +1,51 @@
+import mock
+from django.test import TestCase
+from ..localcache import LocalCache
+
+
+class LocalCacheCase(TestCase):
+    """Test case for local cache"""
+
+    def setUp(self):
+        self.cache = LocalCache(2)
+
+    def test_get_stored_value(self):
+        """Test get stored value"""
+        self.cache.set('key', 'value', 2 ** 32)
+        self.assertEqual(self.cache.get('key'), 'value')
+
+    def test_get_default_when_missing(self):
+        """Test get default when missing"""
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+
+    def test_not_get_expired_value(self):
+        """Test not get expired value"""
+        with mock.patch('time.time', return_value=100):
+            self.cache.set('key', 'value', 150)
+            self.assertEqual(self.cache.get('key'), 'value')
+        with mock.patch('time.time', return_value=200):
+            self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evict_least_recently_used(self):
+        """Test evict least recently used"""
+        self.cache.set('first', 1, 2 ** 32)
+        self.cache.set('second', 2, 2 ** 32)
+        self.cache.get('first')
+        self.cache.set('third', 3, 2 ** 32)
+        self.assertEqual(self.cache.get('first'), 1)
+        self.assertIsNone(self.cache.get('second'))
+        self.assertEqual(self.cache.get('third'), 3)
+
+    def test_delete(self):
+        """Test delete"""
+        self.cache.set('key', 'value', 2 ** 32)
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_disabled_without_size(self):
+        """Test nothing stored when disabled"""
+        cache = LocalCache(0)
+        cache.set('key', 'value', 2 ** 32)
+        self.assertFalse(cache.enabled)
+        self.assertIsNone(cache.get('key'))
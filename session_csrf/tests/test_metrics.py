@@ -0,0 +1,64 @@
+from django.test import TestCase
+from ..metrics import Collector, metrics_view
+from .. import signals
+
+
+class TestCollector(TestCase):
+    """Test metrics collector"""
+
+    def setUp(self):
+        self.collector = Collector(buckets=(0.01, 0.1))
+        self.collector.connect()
+
+    def tearDown(self):
+        self.collector.disconnect()
+
+    def test_count_signals(self):
+        """Test count sent signals"""
+        signals.tokens_issued.send(
+            sender=None, user=None, views=['a', 'b'], duration=0.05)
+        signals.token_cache_checked.send(sender=None, hit=True, duration=0)
+        signals.token_cache_checked.send(sender=None, hit=False, duration=0)
+        signals.token_cache_checked.send(sender=None, hit=False, duration=0)
+        rendered = self.collector.render()
+        self.assertIn('session_csrf_tokens_issued_total 2.0\n', rendered)
+        self.assertIn(
+            'session_csrf_token_cache_total{result="hit"} 1.0\n', rendered)
+        self.assertIn(
+            'session_csrf_token_cache_total{result="miss"} 2.0\n', rendered)
+
+    def test_render_histogram(self):
+        """Test render cumulative histogram buckets"""
+        for duration in (0.005, 0.05, 5):
+            signals.token_validated.send(
+                sender=None, user=None, for_view=None, valid=True,
+                duration=duration)
+        rendered = self.collector.render()
+        self.assertIn('# TYPE session_csrf_token_validation_seconds '
+                      'histogram\n', rendered)
+        for line in (
+            'bucket{result="valid",le="0.01"} 1',
+            'bucket{result="valid",le="0.1"} 2',
+            'bucket{result="valid",le="+Inf"} 3',
+            'count{result="valid"} 3',
+        ):
+            self.assertIn('session_csrf_token_validation_seconds_' + line,
+                          rendered)
+
+    def test_escape_labels(self):
+        """Test escape label values"""
+        signals.request_rejected.send(
+            sender=None, request=None, reason='bad "token"', duration=0)
+        self.assertIn(r'{reason="bad \"token\""}', self.collector.render())
+
+    def test_disconnect(self):
+        """Test not count after disconnect"""
+        self.collector.disconnect()
+        signals.token_cache_checked.send(sender=None, hit=True, duration=0)
+        self.assertEqual(self.collector.render(), '\n')
+
+    def test_metrics_view(self):
+        """Test metrics view"""
+        response = metrics_view(None)
+        self.assertEqual(response['Content-Type'],
+                         'text/plain; version=0.0.4')
@@ -1,15 +1,26 @@
+from datetime import datetime, timedelta
+import time
+from unittest import skipIf
 import mock
 import django.test
+from django import http
 from django.contrib.auth.middleware import AuthenticationMiddleware
 from django.contrib.auth.models import User
 from django.contrib.sessions.middleware import SessionMiddleware
 from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.template import context
 from ..models import Token
+from ..backends import _backends, get_backend
+from ..backends.redis_backend import RedisBackend
 from ..middlewares import CsrfMiddleware
-from ..utils import prep_key
+from ..utils import bump_user_generation, prep_key
 from .. import conf
-from .base import ClientHandler, make_expired
+from .base import ClientHandler, make_expired, per_view
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
 
 
 class TestCsrfToken(django.test.TestCase):
@@ -28,20 +39,20 @@ class TestCsrfToken(django.test.TestCase):
 
     def test_csrftoken_unauthenticated(self):
         # request.csrf_token is '' for anonymous users.
-        response = self.client.get('/', follow=True)
+        response = self.client.get('/token', follow=True)
         self.assertEqual(response._request.csrf_token, '')
 
     def test_csrftoken_authenticated(self):
         # request.csrf_token is a random non-empty string for authed users.
         self.login()
-        response = self.client.get('/', follow=True)
+        response = self.client.get('/token', follow=True)
         # The CSRF token is a 32-character MD5 string.
         self.assertEqual(len(response._request.csrf_token), 32)
 
     def test_csrftoken_new_session(self):
         # The csrf_token is added to request.session the first time.
         self.login()
-        response = self.client.get('/', follow=True)
+        response = self.client.get('/token', follow=True)
         # The CSRF token is a 32-character MD5 string.
         token = response._request.session['csrf_token']
         self.assertEqual(len(token), 32)
@@ -50,13 +61,19 @@ class TestCsrfToken(django.test.TestCase):
     def test_csrftoken_existing_session(self):
         # The csrf_token in request.session is reused on subsequent requests.
         self.login()
-        r1 = self.client.get('/', follow=True)
+        r1 = self.client.get('/token', follow=True)
         token = r1._request.session['csrf_token']
 
-        r2 = self.client.get('/', follow=True)
+        r2 = self.client.get('/token', follow=True)
         self.assertEqual(r1._request.csrf_token, r2._request.csrf_token)
         self.assertEqual(token, r2._request.csrf_token)
 
+    def test_csrftoken_not_used(self):
+        # The session isn't touched when the token isn't used.
+        self.login()
+        response = self.client.get('/', follow=True)
+        self.assertNotIn('csrf_token', response._request.session)
+
 
 class TestCsrfMiddleware(django.test.TestCase):
 
@@ -208,6 +225,243 @@ class TestCsrfMiddleware(django.test.TestCase):
         self.assertIsNotNone(request.csrf_token)
 
 
+class TestNewStyleCsrfMiddleware(django.test.TestCase):
+    """Test middleware called with get_response"""
+
+    def setUp(self):
+        self.rf = django.test.RequestFactory()
+        self.save_ANON_ALWAYS = conf.ANON_ALWAYS
+        conf.ANON_ALWAYS = True
+
+    def tearDown(self):
+        conf.ANON_ALWAYS = self.save_ANON_ALWAYS
+
+    def _request(self):
+        request = self.rf.get('/')
+        SessionMiddleware().process_request(request)
+        AuthenticationMiddleware().process_request(request)
+        return request
+
+    def test_process_response(self):
+        """Test set anonymous cookie when view uses token"""
+        request = self._request()
+        mw = CsrfMiddleware(lambda r: http.HttpResponse(r.csrf_token))
+        response = mw(request)
+        self.assertEqual(response.content, request.csrf_token)
+        self.assertIn(conf.ANON_COOKIE, response.cookies)
+
+    def test_keep_existing_token(self):
+        """Test keep token set before the middleware"""
+        request = self._request()
+        request.csrf_token = 'woo'
+        response = CsrfMiddleware(lambda r: http.HttpResponse())(request)
+        self.assertEqual(request.csrf_token, 'woo')
+        self.assertNotIn(conf.ANON_COOKIE, response.cookies)
+
+
+class TestSessionTokenProof(django.test.TestCase):
+    """Test skipping token checks when the session proves validity"""
+
+    def setUp(self):
+        cache.clear()
+        self.mw = CsrfMiddleware()
+        self._user = User.objects.create()
+        self._user.is_authenticated = lambda: True
+        self.token = Token.objects.create(owner=self._user)
+
+    def _request(self, **session):
+        request = mock.MagicMock(
+            user=self._user,
+            session=dict({'csrf_token': self.token.value}, **session),
+            POST={},
+            META={'HTTP_X_CSRFTOKEN': self.token.value},
+            csrf_processing_done=False,
+            _dont_enforce_csrf_checks=False)
+        del request.csrf_token
+        return request
+
+    def test_not_query_when_session_proves_token(self):
+        """Test not query tokens when session proves token"""
+        request = self._request(csrf_token_issued=time.time(),
+                                csrf_token_generation=0)
+        with self.assertNumQueries(0):
+            self.mw.process_request(request)
+            self.assertIsNone(
+                self.mw.process_view(request, None, None, None))
+        self.assertEqual(request.csrf_token, self.token.value)
+
+    def test_store_issue_time_when_missing(self):
+        """Test check token and store issue time when session hasn't it"""
+        request = self._request()
+        with self.assertNumQueries(1):
+            self.mw.process_request(request)
+            self.mw.process_view(request, None, None, None)
+        self.assertEqual(request.csrf_token, self.token.value)
+        self.assertEqual(request.session['csrf_token_generation'], 0)
+        self.assertLessEqual(request.session['csrf_token_issued'],
+                             time.time())
+
+    def test_check_token_when_generation_is_stale(self):
+        """Test check token when session has stale generation"""
+        Token.objects.all().delete()
+        request = self._request(csrf_token_issued=time.time(),
+                                csrf_token_generation=-1)
+        self.mw.process_request(request)
+        self.assertNotEqual(request.csrf_token, self.token.value)
+        self.assertEqual(request.session['csrf_token_generation'], 0)
+
+    def test_renew_token_when_revoked(self):
+        """Test renew token issued before revocation of user tokens"""
+        Token.objects.filter(pk=self.token.pk).update(
+            created=datetime.now() - timedelta(seconds=10))
+        request = self._request(csrf_token_issued=time.time() - 10,
+                                csrf_token_generation=0)
+        bump_user_generation(self._user)
+        self.mw.process_request(request)
+        self.assertNotEqual(request.csrf_token, self.token.value)
+        self.assertTrue(self.mw._is_valid_token(request, request.csrf_token))
+
+    def test_renew_token_when_expired(self):
+        """Test renew token when session proves that it's expired"""
+        make_expired(self.token)
+        request = self._request(csrf_token_issued=0, csrf_token_generation=0)
+        self.mw.process_request(request)
+        self.assertNotEqual(request.csrf_token, self.token.value)
+
+    def test_store_issue_time_for_new_token(self):
+        """Test store issue time and generation of new token"""
+        request = self._request()
+        request.session = {}
+        self.mw.process_request(request)
+        token = request.csrf_token.resolve()
+        self.assertEqual(request.session['csrf_token'], token)
+        self.assertIn('csrf_token_issued', request.session)
+        self.assertEqual(request.session['csrf_token_generation'], 0)
+
+    def test_accept_previous_token_from_ring(self):
+        """Test accept replaced token from the ring without queries"""
+        request = self._request()
+        self.mw._store_token(request, 'previous', time.time())
+        self.mw._store_token(request, self.token.value, time.time())
+        request.META['HTTP_X_CSRFTOKEN'] = 'previous'
+        with self.assertNumQueries(0):
+            self.mw.process_request(request)
+            self.assertIsNone(
+                self.mw.process_view(request, None, None, None))
+
+    def test_accept_rotated_token(self):
+        """Test rotate old token and accept it from the ring"""
+        issued = time.time() - conf.CSRF_TOKEN_LIFETIME.total_seconds() * (
+            conf.CSRF_TOKEN_ROTATE_RATIO + 0.1)
+        Token.objects.filter(pk=self.token.pk).update(
+            created=datetime.fromtimestamp(issued))
+        request = self._request()
+        request.session = {}
+        self.mw._store_token(request, self.token.value, issued)
+        self.mw.process_request(request)
+        self.assertNotEqual(request.csrf_token, self.token.value)
+        self.assertEqual(request.session['csrf_token'], request.csrf_token)
+
+        request = self._request(**request.session)
+        request.META['HTTP_X_CSRFTOKEN'] = self.token.value
+        with self.assertNumQueries(0):
+            self.mw.process_request(request)
+            self.assertIsNone(
+                self.mw.process_view(request, None, None, None))
+
+    def test_not_rotate_fresh_token(self):
+        """Test keep token until the rotation part of lifetime passed"""
+        request = self._request(csrf_token_issued=time.time(),
+                                csrf_token_generation=0)
+        self.mw.process_request(request)
+        self.assertEqual(request.csrf_token, self.token.value)
+
+    def test_ring_is_bounded(self):
+        """Test ring keeps only recent tokens"""
+        request = self._request()
+        for n in range(conf.CSRF_TOKEN_RING_SIZE + 1):
+            self.mw._store_token(request, 'token{}'.format(n), time.time())
+        self.assertEqual(len(request.session['csrf_tokens']),
+                         conf.CSRF_TOKEN_RING_SIZE)
+        self.assertFalse(self.mw._is_in_ring(request, 'token0'))
+        self.assertTrue(self.mw._is_in_ring(request, 'token1'))
+
+    def test_not_accept_expired_token_from_ring(self):
+        """Test not accept expired token from the ring"""
+        request = self._request()
+        self.mw._store_token(request, 'previous', 0)
+        self.mw._store_token(request, self.token.value, time.time())
+        self.assertFalse(self.mw._is_in_ring(request, 'previous'))
+        request.session['csrf_tokens'].append(['previous', 0])
+        self.assertFalse(self.mw._is_in_ring(request, 'previous'))
+
+
+class TestSingleFlightTokenIssue(django.test.TestCase):
+    """Test concurrent requests of a user converge on one new token"""
+
+    def setUp(self):
+        cache.clear()
+        self.mw = CsrfMiddleware()
+        self._user = User.objects.create()
+        self._user.is_authenticated = lambda: True
+
+    def _resolve(self):
+        request = mock.MagicMock(user=self._user, session={})
+        del request.csrf_token
+        self.mw.process_request(request)
+        return request.csrf_token.resolve()
+
+    def test_share_new_token(self):
+        """Test requests with stale sessions share one new token"""
+        tokens = set(self._resolve() for _ in range(3))
+        self.assertEqual(len(tokens), 1)
+        self.assertEqual(Token.objects.count(), 1)
+
+    def test_wait_for_lock_owner(self):
+        """Test wait for the token issued by the lock owner"""
+        self._resolve()
+        cache.clear()
+        cache.add(prep_key('issued:{}:0:0:lock'.format(self._user.pk)), True)
+
+        def issue(seconds):
+            cache.set(prep_key('issued:{}:0:0'.format(self._user.pk)),
+                      ('token', time.time()))
+        with mock.patch('time.sleep', side_effect=issue) as sleep:
+            self.assertEqual(self._resolve(), 'token')
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(Token.objects.count(), 1)
+
+    def test_issue_when_lock_owner_failed(self):
+        """Test issue own token when the lock owner didn't issue one"""
+        cache.add(prep_key('issued:{}:0:0:lock'.format(self._user.pk)), True)
+        clock = [time.time()]
+
+        def sleep(seconds):
+            clock[0] += seconds
+        with mock.patch('time.sleep', side_effect=sleep):
+            with mock.patch('time.time', side_effect=lambda: clock[0]):
+                token = self._resolve()
+        self.assertTrue(Token.objects.has_valid(self._user, token))
+
+    def test_release_lock_when_issue_failed(self):
+        """Test release the lock when issuing token raised"""
+        with mock.patch.object(self.mw, '_issue_new_token',
+                               side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                self._resolve()
+        self.assertIsNone(
+            cache.get(prep_key('issued:{}:0:0:lock'.format(self._user.pk))))
+        with mock.patch('time.sleep') as sleep:
+            self._resolve()
+        self.assertFalse(sleep.called)
+
+    def test_disabled(self):
+        """Test every request issues token when disabled"""
+        with mock.patch.object(conf, 'CSRF_TOKEN_ISSUE_TIMEOUT', 0):
+            tokens = set(self._resolve() for _ in range(3))
+        self.assertEqual(len(tokens), 3)
+
+
 class TestPerViewCsrf(django.test.TestCase):
     """Per view csrf test case"""
 
@@ -219,7 +473,7 @@ class TestPerViewCsrf(django.test.TestCase):
     def _get_token(self):
         return Token.objects.create(
             owner=self.user,
-            for_view="session_csrf.tests.base.per_view",
+            for_view=per_view.per_view_csrf_id,
         )
 
     def test_ok_with_correct_per_view_csrf(self):
@@ -241,3 +495,237 @@ class TestPerViewCsrf(django.test.TestCase):
         """Test not ok without token"""
         response = self.client.post('/per-view')
         self.assertEqual(response.status_code, 403)
+
+
+class BackendCsrfMiddlewareTestMixin(object):
+    """Csrf middleware tests that run against every token backend"""
+    backend = None
+
+    def setUp(self):
+        cache.clear()
+        self.mw = CsrfMiddleware()
+        self._user = User.objects.create()
+        self._user.is_authenticated = lambda: True
+        self.save_CSRF_TOKEN_BACKEND = conf.CSRF_TOKEN_BACKEND
+        conf.CSRF_TOKEN_BACKEND = self.backend
+
+    def tearDown(self):
+        conf.CSRF_TOKEN_BACKEND = self.save_CSRF_TOKEN_BACKEND
+
+    def _request(self, token='', session=None, **kwargs):
+        return mock.MagicMock(
+            user=self._user,
+            session={} if session is None else session,
+            POST={},
+            META={'HTTP_X_CSRFTOKEN': token},
+            csrf_processing_done=False,
+            _dont_enforce_csrf_checks=False,
+            **kwargs)
+
+    def test_add_token_on_request(self):
+        """Test add token on request"""
+        request = self._request()
+        del request.csrf_token
+        self.mw.process_request(request)
+        token = request.csrf_token.resolve()
+        self.assertEqual(request.session['csrf_token'], token)
+
+    def test_not_change_valid_token(self):
+        """Test not change valid token"""
+        token = get_backend().issue(self._user)
+        request = self._request(session={'csrf_token': token})
+        del request.csrf_token
+        self.mw.process_request(request)
+        self.assertEqual(request.csrf_token, token)
+
+    def test_accept_valid_token(self):
+        """Test accept valid token"""
+        token = get_backend().issue(self._user)
+        request = self._request(token, csrf_token=token)
+        self.assertIsNone(self.mw.process_view(request, None, None, None))
+
+    def test_reject_unknown_token(self):
+        """Test reject unknown token"""
+        request = self._request('a' * 32, csrf_token='a' * 32)
+        self.assertIsNotNone(self.mw.process_view(request, None, None, None))
+
+    def test_accept_per_view_token(self):
+        """Test accept token issued for view"""
+        token = get_backend().issue(self._user, per_view.per_view_csrf_id)
+        request = self._request(token)
+        self.assertIsNone(self.mw.process_view(request, per_view, None, None))
+
+    def test_reject_main_token_for_per_view(self):
+        """Test reject main token for view with per-view csrf"""
+        token = get_backend().issue(self._user)
+        request = self._request(token, csrf_token=token)
+        self.assertIsNotNone(
+            self.mw.process_view(request, per_view, None, None))
+
+    def test_reject_revoked_per_view_token(self):
+        """Test reject token for view issued before revocation"""
+        token = get_backend().issue(self._user, per_view.per_view_csrf_id)
+        bump_user_generation(self._user)
+        request = self._request(token)
+        self.assertIsNotNone(
+            self.mw.process_view(request, per_view, None, None))
+
+    def test_replace_revoked_per_view_token(self):
+        """Test replace token for view issued before revocation"""
+        view = per_view.per_view_csrf_id
+        token = get_backend().issue_many(self._user, [view])[view]
+        bump_user_generation(self._user)
+        new_token = get_backend().issue_many(self._user, [view])[view]
+        self.assertNotEqual(new_token, token)
+        request = self._request(new_token)
+        self.assertIsNone(self.mw.process_view(request, per_view, None, None))
+
+
+class TestDatabaseBackendCsrfMiddleware(BackendCsrfMiddlewareTestMixin,
+                                        django.test.TestCase):
+    backend = 'session_csrf.backends.db.DatabaseBackend'
+
+
+class TestCacheBackendCsrfMiddleware(BackendCsrfMiddlewareTestMixin,
+                                     django.test.TestCase):
+    backend = 'session_csrf.backends.cache.CacheBackend'
+
+    def test_not_query_database(self):
+        """Test cache backend don't touch database"""
+        request = self._request()
+        del request.csrf_token
+        with self.assertNumQueries(0):
+            self.mw.process_request(request)
+
+
+class TestSignedBackendCsrfMiddleware(BackendCsrfMiddlewareTestMixin,
+                                      django.test.TestCase):
+    backend = 'session_csrf.backends.signed.SignedBackend'
+
+    def test_not_query_database(self):
+        """Test signed backend don't touch database"""
+        request = self._request()
+        del request.csrf_token
+        with self.assertNumQueries(0):
+            self.mw.process_request(request)
+            self.mw.process_view(request, None, None, None)
+
+    def test_reject_expired_token(self):
+        """Test reject expired signed token"""
+        token = get_backend().issue(self._user)
+        request = self._request(token, csrf_token=token)
+        with mock.patch.object(conf, 'CSRF_TOKEN_LIFETIME', timedelta(-1)):
+            self.assertIsNotNone(
+                self.mw.process_view(request, None, None, None))
+
+
+@skipIf(fakeredis is None, 'fakeredis is not installed')
+class TestRedisBackendCsrfMiddleware(BackendCsrfMiddlewareTestMixin,
+                                     django.test.TestCase):
+    backend = 'session_csrf.backends.redis_backend.RedisBackend'
+
+    def setUp(self):
+        client = fakeredis.FakeStrictRedis()
+        client.flushall()
+        _backends[self.backend] = RedisBackend(client)
+        super(TestRedisBackendCsrfMiddleware, self).setUp()
+
+    def tearDown(self):
+        super(TestRedisBackendCsrfMiddleware, self).tearDown()
+        _backends.pop(self.backend, None)
+
+    def test_not_query_database(self):
+        """Test redis backend don't touch database"""
+        request = self._request()
+        del request.csrf_token
+        with self.assertNumQueries(0):
+            self.mw.process_request(request)
+
+
+class TestExemptPaths(django.test.TestCase):
+    """Test skipping csrf for exempt paths"""
+
+    def setUp(self):
+        self.mw = CsrfMiddleware()
+        self.rf = django.test.RequestFactory()
+        self.settings = mock.patch.multiple(
+            conf, CSRF_EXEMPT_PATHS=('/health',),
+            CSRF_EXEMPT_PATH_REGEXES=(r'/hooks/\w+/$',))
+        self.settings.start()
+
+    def tearDown(self):
+        self.settings.stop()
+
+    def test_skip_exempt_prefix(self):
+        """Test skip token and checks for exempt path prefix"""
+        request = self.rf.post('/health/db')
+        self.mw.process_request(request)
+        self.assertFalse(hasattr(request, 'csrf_token'))
+        self.assertIsNone(self.mw.process_view(request, None, None, None))
+
+    def test_skip_exempt_regex(self):
+        """Test skip checks for path matching exempt regex"""
+        request = self.rf.post('/hooks/github/')
+        self.mw.process_request(request)
+        self.assertIsNone(self.mw.process_view(request, None, None, None))
+
+    def test_check_other_paths(self):
+        """Test check paths that aren't exempt"""
+        request = self.rf.post('/hooks/github/push')
+        request.user = User.objects.create()
+        request.session = {}
+        self.mw.process_request(request)
+        self.assertEqual(
+            self.mw.process_view(request, None, None, None).status_code, 403)
+
+
+def is_api_request(request):
+    return request.META.get('HTTP_X_API_CLIENT') == 'yes'
+
+
+class TestExemptApiClients(django.test.TestCase):
+    """Test skipping csrf for API clients"""
+
+    def setUp(self):
+        self.mw = CsrfMiddleware()
+        self.rf = django.test.RequestFactory()
+        self.settings = mock.patch.multiple(
+            conf, CSRF_EXEMPT_AUTH_SCHEMES=('Bearer',),
+            CSRF_EXEMPT_PREDICATES=(
+                'session_csrf.tests.test_middlewares.is_api_request',))
+        self.settings.start()
+        self._user = User.objects.create()
+
+    def tearDown(self):
+        self.settings.stop()
+
+    def _process(self, **headers):
+        request = self.rf.post('/', **headers)
+        request.user = self._user
+        request.session = {}
+        self.mw.process_request(request)
+        return request, self.mw.process_view(request, None, None, None)
+
+    def test_skip_exempt_auth_scheme(self):
+        """Test skip token and checks for exempt authorization scheme"""
+        with self.assertNumQueries(0):
+            request, response = self._process(
+                HTTP_AUTHORIZATION='bearer secret')
+        self.assertIsNone(response)
+        self.assertFalse(hasattr(request, 'csrf_token'))
+
+    def test_skip_when_predicate_matches(self):
+        """Test skip checks when exempt predicate matches request"""
+        self.assertIsNone(self._process(HTTP_X_API_CLIENT='yes')[1])
+
+    def test_check_other_clients(self):
+        """Test check requests of other clients"""
+        response = self._process(HTTP_AUTHORIZATION='Basic secret')[1]
+        self.assertEqual(response.status_code, 403)
+
+    def test_raise_on_wrong_predicate(self):
+        """Test raise when predicate can't be loaded"""
+        with mock.patch.object(conf, 'CSRF_EXEMPT_PREDICATES',
+                               ('session_csrf.tests.wrong',)):
+            with self.assertRaises(ImproperlyConfigured):
+                self._process()
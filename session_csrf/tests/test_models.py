@@ -1,6 +1,14 @@
+import threading
 import django.test
+import mock
 from django.contrib.auth.models import User
-from ..models import Token
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.db.models.signals import post_delete, post_save
+from ..localcache import LocalCache
+from ..models import Token, atomic, get_period, invalidate_cached_token
+from ..utils import bump_user_generation
+from .. import models, signals
 from .base import make_expired
 
 
@@ -61,3 +69,215 @@ class TokenModelCase(django.test.TestCase):
         self.assertTrue(
             Token.objects.has_valid(self._user, token.value, 'test'),
         )
+
+    def test_store_current_period(self):
+        """Test token stored with the current period"""
+        token = Token.objects.create(owner=self._user)
+        self.assertEqual(Token.objects.get(pk=token.pk).period, get_period())
+
+    def test_has_no_valid_token_in_old_period(self):
+        """Test lookup ignores tokens of old periods"""
+        token = Token.objects.create(owner=self._user)
+        Token.objects.filter(pk=token.pk).update(period=get_period() - 2)
+        self.assertFalse(
+            Token.objects.has_valid(self._user, token.value),
+        )
+
+    def test_delete_expired_periods(self):
+        """Test drop only periods older than the previous one"""
+        valid = Token.objects.create(owner=self._user)
+        previous = Token.objects.create(owner=self._user)
+        Token.objects.filter(pk=previous.pk).update(period=get_period() - 1)
+        for _ in range(3):
+            make_expired(Token.objects.create(owner=self._user))
+        self.assertEqual(Token.objects.delete_expired_periods(), 3)
+        self.assertItemsEqual(Token.objects.all(), [valid, previous])
+
+    def test_one_token_for_view(self):
+        """Test only one token for view and user"""
+        Token.objects.create(owner=self._user, for_view='test')
+        with self.assertRaises(IntegrityError):
+            with atomic():
+                Token.objects.create(owner=self._user, for_view='test')
+
+
+class IssueForViewsCase(django.test.TestCase):
+    """Test case for issuing per-view tokens"""
+
+    def setUp(self):
+        cache.clear()
+        self._user = User.objects.create_user('test', 'test@test.test', 'test')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_rotate_revoked_tokens(self):
+        """Test tokens created before revocation are rotated"""
+        token = Token.objects.create(owner=self._user, for_view='a')
+        bump_user_generation(self._user)
+        created = set()
+        tokens = Token.objects.issue_for_views(self._user, ['a'], created)
+        self.assertEqual(created, set(['a']))
+        self.assertNotEqual(tokens['a'], token.value)
+        self.assertEqual(Token.objects.get(pk=token.pk).value, tokens['a'])
+        self.assertTrue(Token.objects.has_valid(self._user, tokens['a'], 'a'))
+
+    def test_rotate_revoked_tokens_without_upsert(self):
+        """Test rotate revoked tokens without upserts"""
+        token = Token.objects.create(owner=self._user, for_view='a')
+        bump_user_generation(self._user)
+        created = set()
+        with mock.patch.object(Token.objects, '_get_upsert_sql',
+                               return_value=(None, 0, False)):
+            tokens = Token.objects.issue_for_views(
+                self._user, ['a', 'b'], created)
+        self.assertEqual(created, set(['a', 'b']))
+        self.assertNotEqual(tokens['a'], token.value)
+        self.assertTrue(Token.objects.has_valid(self._user, tokens['a'], 'a'))
+
+    def test_create_missing_tokens(self):
+        """Test create missing tokens with one statement"""
+        with self.assertNumQueries(2):
+            tokens = Token.objects.issue_for_views(self._user, ['a', 'b'])
+        for view, value in tokens.items():
+            self.assertTrue(Token.objects.has_valid(self._user, value, view))
+
+    def test_reuse_valid_tokens(self):
+        """Test reuse valid tokens"""
+        token = Token.objects.create(owner=self._user, for_view='a')
+        created = set()
+        with self.assertNumQueries(1):
+            tokens = Token.objects.issue_for_views(self._user, ['a'], created)
+        self.assertEqual(tokens, {'a': token.value})
+        self.assertEqual(created, set())
+
+    def test_rotate_expired_token_in_place(self):
+        """Test replace expired token in the same row"""
+        token = make_expired(Token.objects.create(
+            owner=self._user, for_view='a'))
+        tokens = Token.objects.issue_for_views(self._user, ['a', 'b'])
+        self.assertNotEqual(tokens['a'], token.value)
+        self.assertEqual(Token.objects.get(pk=token.pk).value, tokens['a'])
+        self.assertEqual(Token.objects.get(pk=token.pk).period, get_period())
+        self.assertTrue(Token.objects.has_valid(self._user, tokens['a'], 'a'))
+        self.assertEqual(Token.objects.count(), 2)
+
+    def test_rotate_without_upsert(self):
+        """Test rotate tokens when database doesn't support upserts"""
+        token = make_expired(Token.objects.create(
+            owner=self._user, for_view='a'))
+        with mock.patch.object(Token.objects, '_get_upsert_sql',
+                               return_value=(None, 0, False)):
+            tokens = Token.objects.issue_for_views(self._user, ['a', 'b'])
+        self.assertEqual(Token.objects.get(pk=token.pk).value, tokens['a'])
+        self.assertTrue(Token.objects.has_valid(self._user, tokens['a'], 'a'))
+        self.assertTrue(Token.objects.has_valid(self._user, tokens['b'], 'b'))
+        self.assertEqual(Token.objects.count(), 2)
+
+
+class IssueForViewsConcurrencyCase(django.test.TransactionTestCase):
+    """Stress test issuing per-view tokens from many threads"""
+    threads = 8
+    rounds = 5
+    views = ['a', 'b', 'c']
+
+    def setUp(self):
+        name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite' and (
+            not name or name == ':memory:' or 'mode=memory' in name
+        ):
+            self.skipTest("in-memory sqlite isn't shared between threads")
+        self._user = User.objects.create_user('test', 'test@test.test', 'test')
+
+    def _issue(self, results, created, errors):
+        try:
+            for _ in range(self.rounds):
+                written = set()
+                results.append(Token.objects.issue_for_views(
+                    self._user, self.views, written))
+                created.extend(written)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def test_one_token_for_view_and_user(self):
+        """Test concurrent renders get the same tokens without duplicates"""
+        make_expired(Token.objects.create(owner=self._user, for_view='a'))
+        results = []
+        created = []
+        errors = []
+        threads = [threading.Thread(target=self._issue,
+                                    args=(results, created, errors))
+                   for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), self.threads * self.rounds)
+        for tokens in results:
+            self.assertEqual(tokens, results[0])
+        self.assertEqual(sorted(created), self.views)
+        self.assertEqual(
+            Token.objects.filter(for_view__isnull=False).count(),
+            len(self.views))
+
+
+class TokenCacheCase(django.test.TestCase):
+    """Test case for validated tokens cache"""
+
+    def setUp(self):
+        self._user = User.objects.create_user('test', 'test@test.test', 'test')
+        self._patcher = mock.patch.object(
+            models, 'valid_tokens', LocalCache(10))
+        self._patcher.start()
+        post_save.connect(invalidate_cached_token, sender=Token)
+        post_delete.connect(invalidate_cached_token, sender=Token)
+
+    def tearDown(self):
+        post_save.disconnect(invalidate_cached_token, sender=Token)
+        post_delete.disconnect(invalidate_cached_token, sender=Token)
+        self._patcher.stop()
+
+    def test_not_query_cached_token(self):
+        """Test not query database for cached token"""
+        token = Token.objects.create(owner=self._user)
+        Token.objects.has_valid(self._user, token.value)
+        with self.assertNumQueries(0):
+            self.assertTrue(Token.objects.has_valid(self._user, token.value))
+
+    def test_not_cache_invalid_token(self):
+        """Test not cache invalid token"""
+        Token.objects.has_valid(self._user, 'token')
+        self.assertEqual(len(models.valid_tokens), 0)
+
+    def test_invalidate_on_delete(self):
+        """Test invalidate cached token on delete"""
+        token = Token.objects.create(owner=self._user)
+        Token.objects.has_valid(self._user, token.value)
+        token.delete()
+        self.assertFalse(Token.objects.has_valid(self._user, token.value))
+
+    def test_invalidate_on_expire(self):
+        """Test invalidate cached token when expired"""
+        token = Token.objects.create(owner=self._user)
+        Token.objects.has_valid(self._user, token.value)
+        make_expired(token)
+        self.assertFalse(Token.objects.has_valid(self._user, token.value))
+
+    def test_send_cache_checks(self):
+        """Test send cache checks with the time spent"""
+        token = Token.objects.create(owner=self._user)
+        receiver = mock.Mock()
+        signals.token_cache_checked.connect(receiver)
+        try:
+            Token.objects.has_valid(self._user, token.value)
+            Token.objects.has_valid(self._user, token.value)
+        finally:
+            signals.token_cache_checked.disconnect(receiver)
+        self.assertEqual(
+            [call[1]['hit'] for call in receiver.call_args_list],
+            [False, True])
+        for call in receiver.call_args_list:
+            self.assertGreaterEqual(call[1]['duration'], 0)
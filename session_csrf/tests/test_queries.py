@@ -0,0 +1,106 @@
+import time
+import django.test
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.db import SessionStore
+from ..backends import get_backend
+from ..middlewares import CsrfMiddleware
+from ..models import Token
+from .base import per_view
+
+
+class TestCsrfQueries(django.test.TestCase):
+    """Pins amount of queries made by the middleware on each path"""
+
+    def setUp(self):
+        self.rf = django.test.RequestFactory()
+        self.mw = CsrfMiddleware()
+        self.user = User.objects.create_user('test', 'test@test.test', 'test')
+        self.token = Token.objects.create(owner=self.user).value
+
+    def _session(self, **data):
+        session = SessionStore()
+        session.update(data)
+        session.save()
+        session = SessionStore(session.session_key)
+        session.keys()  # loads the session
+        return session
+
+    def _proved_session(self):
+        return self._session(csrf_token=self.token,
+                             csrf_token_issued=time.time(),
+                             csrf_token_generation=0)
+
+    def _process(self, request, user, session, view=None, use_token=False):
+        request.user = user
+        request.session = session
+        request._dont_enforce_csrf_checks = False
+        self.mw.process_request(request)
+        response = self.mw.process_view(request, view, (), {})
+        if use_token:
+            request.csrf_token.resolve()
+        return response
+
+    def test_anonymous_get(self):
+        """Test anonymous GET doesn't query"""
+        session = self._session()
+        with self.assertNumQueries(0):
+            self._process(self.rf.get('/'), AnonymousUser(), session)
+
+    def test_authenticated_get(self):
+        """Test authenticated GET with fresh session doesn't query"""
+        session = self._proved_session()
+        with self.assertNumQueries(0):
+            self._process(self.rf.get('/'), self.user, session)
+
+    def test_authenticated_get_without_proof(self):
+        """Test authenticated GET checks token once without session proof"""
+        session = self._session(csrf_token=self.token)
+        with self.assertNumQueries(1):
+            self._process(self.rf.get('/'), self.user, session,
+                          use_token=True)
+
+    def test_authenticated_get_new_session(self):
+        """Test authenticated GET creates token for new session"""
+        session = self._session()
+        with self.assertNumQueries(1):
+            self._process(self.rf.get('/'), self.user, session,
+                          use_token=True)
+
+    def test_authenticated_get_unused_token(self):
+        """Test authenticated GET doesn't query when token isn't used"""
+        for session in (self._session(csrf_token=self.token),
+                        self._session()):
+            with self.assertNumQueries(0):
+                self._process(self.rf.get('/'), self.user, session)
+            self.assertNotIn('csrf_token_issued', session)
+
+    def test_authenticated_post(self):
+        """Test authenticated POST with fresh session doesn't query"""
+        session = self._proved_session()
+        request = self.rf.post('/', {'csrfmiddlewaretoken': self.token})
+        with self.assertNumQueries(0):
+            self.assertIsNone(self._process(request, self.user, session))
+
+    def test_authenticated_post_without_proof(self):
+        """Test authenticated POST checks token once without session proof"""
+        session = self._session(csrf_token=self.token)
+        request = self.rf.post('/', {'csrfmiddlewaretoken': self.token})
+        with self.assertNumQueries(1):
+            self.assertIsNone(self._process(request, self.user, session))
+
+    def test_per_view_post(self):
+        """Test per-view POST checks only per-view token"""
+        token = get_backend().issue(self.user, per_view.per_view_csrf_id)
+        session = self._proved_session()
+        request = self.rf.post('/', {'csrfmiddlewaretoken': token})
+        with self.assertNumQueries(1):
+            self.assertIsNone(
+                self._process(request, self.user, session, per_view))
+
+    def test_memoize_checks_for_request(self):
+        """Test same token checked once for request"""
+        request = self.rf.post('/', {'csrfmiddlewaretoken': 'wrong'})
+        self._process(request, self.user, self._proved_session(), per_view)
+        with self.assertNumQueries(0):
+            self.assertFalse(
+                self.mw._check_per_view_csrf(request, per_view, 'wrong'))
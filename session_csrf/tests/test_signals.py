@@ -0,0 +1,105 @@
+from contextlib import contextmanager
+import django.test
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from ..backends import get_backend
+from ..middlewares import CsrfMiddleware
+from ..utils import get_tokens_for_request, prep_key
+from .. import anonymous, signals
+
+
+@contextmanager
+def receive(signal):
+    """Collect kwargs of sent signals"""
+    received = []
+
+    def receiver(**kwargs):
+        received.append(kwargs)
+    signal.connect(receiver)
+    try:
+        yield received
+    finally:
+        signal.disconnect(receiver)
+
+
+class TestSignals(django.test.TestCase):
+    """Test instrumentation signals"""
+
+    def setUp(self):
+        cache.clear()
+        self.rf = django.test.RequestFactory()
+        self.mw = CsrfMiddleware()
+        self.user = User.objects.create_user('test', 'test@test.test', 'test')
+
+    def _request(self, request, session=None):
+        request.user = self.user
+        request.session = {} if session is None else session
+        request._dont_enforce_csrf_checks = False
+        return request
+
+    def test_tokens_issued(self):
+        """Test send when new token issued"""
+        request = self._request(self.rf.get('/'))
+        self.mw.process_request(request)
+        with receive(signals.tokens_issued) as received:
+            request.csrf_token.resolve()
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]['views'], [None])
+        self.assertEqual(received[0]['user'], self.user)
+        self.assertGreaterEqual(received[0]['duration'], 0)
+
+    def test_per_view_tokens_issued(self):
+        """Test send once for missing per-view tokens"""
+        request = self._request(self.rf.get('/'))
+        with receive(signals.tokens_issued) as received:
+            get_tokens_for_request(request, ['a', 'b'])
+            get_tokens_for_request(request, ['a', 'b'])
+        self.assertEqual(len(received), 1)
+        self.assertEqual(sorted(received[0]['views']), ['a', 'b'])
+
+    def test_per_view_tokens_not_issued_again(self):
+        """Test send only for per-view tokens the backend created"""
+        get_tokens_for_request(self._request(self.rf.get('/')), ['a'])
+        with receive(signals.tokens_issued) as received:
+            get_tokens_for_request(self._request(self.rf.get('/')), ['a'])
+            get_tokens_for_request(self._request(self.rf.get('/')),
+                                   ['a', 'b'])
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]['views'], ['b'])
+
+    def test_token_validated(self):
+        """Test send when token checked in the backend"""
+        token = get_backend().issue(self.user)
+        request = self._request(self.rf.post(
+            '/', {'csrfmiddlewaretoken': token}), {'csrf_token': token})
+        self.mw.process_request(request)
+        with receive(signals.token_validated) as received:
+            self.assertIsNone(self.mw.process_view(request, None, (), {}))
+        self.assertEqual(len(received), 1)
+        self.assertTrue(received[0]['valid'])
+        self.assertIsNone(received[0]['for_view'])
+
+    def test_request_rejected(self):
+        """Test send when request rejected"""
+        request = self._request(self.rf.post(
+            '/', {'csrfmiddlewaretoken': 'wrong'}))
+        self.mw.process_request(request)
+        with receive(signals.request_rejected) as received:
+            response = self.mw.process_view(request, None, (), {})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]['request'], request)
+        self.assertIn('reason', received[0])
+
+    def test_anonymous_token(self):
+        """Test send on anonymous token cache calls"""
+        request = self.rf.get('/')
+        with receive(signals.anonymous_token_stored) as stored:
+            key = anonymous.issue_token(request)[0]
+        self.assertEqual(len(stored), 1)
+        request.COOKIES['anoncsrf'] = key
+        with receive(signals.anonymous_token_read) as read:
+            anonymous.get_token(request)
+            cache.delete(prep_key(key))
+            anonymous.get_token(request)
+        self.assertEqual([kwargs['found'] for kwargs in read], [True, False])
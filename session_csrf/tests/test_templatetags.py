@@ -1,30 +1,72 @@
 from mock import MagicMock
 from django.contrib.auth.models import User
+from django.template import Context, Template
 from django.test import TestCase
 from ..models import Token
-from ..templatetags.session_csrf import per_view_csrf
+from ..registry import get_view_id
 
 
 class PerViewCsrfCase(TestCase):
     """per_view_csrf templatetag case"""
 
+    def setUp(self):
+        self.request = MagicMock(user=User.objects.create())
+        self.request.user.is_authenticated = lambda: True
+
+    def _render(self, content, **context):
+        return Template('{% load session_csrf %}' + content).render(
+            Context(context))
+
     def test_should_generate_csrf_token_when_authenticated(self):
         """Test template tag should generate csrf when authenticated"""
-        request = MagicMock(user=User.objects.create())
-        request.user.is_authenticated = lambda: True
-        self.assertNotEqual(per_view_csrf({
-            'request': request,
-        }, 'test'), '')
+        self.assertNotEqual(self._render(
+            '{% per_view_csrf "test" %}', request=self.request,
+        ), '')
         self.assertTrue(Token.objects.filter(
-            owner=request.user,
-            for_view='test',
+            owner=self.request.user,
+            for_view=get_view_id('test'),
         ).exists())
 
     def test_should_fallback_to_default_csrf_when_not_authenticated(self):
         """Test should fallback to default csrf when not authenticated"""
         request = MagicMock()
         request.user.is_authenticated.return_value = False
-        self.assertNotEqual(per_view_csrf({
-            'request': request,
-            'csrf_token': 'test',
-        }, 'test'), '')
+        self.assertIn('test', self._render(
+            '{% per_view_csrf "test" %}', request=request, csrf_token='test',
+        ))
+
+    def test_should_restore_csrf_token(self):
+        """Test should restore csrf token after rendering"""
+        self.assertIn('global', self._render(
+            '{% per_view_csrf "test" %}{% csrf_token %}',
+            request=self.request, csrf_token='global',
+        ))
+
+    def test_should_render_token_for_view(self):
+        """Test should render token for its view"""
+        content = self._render(
+            '{% per_view_csrf "first" %}{% per_view_csrf name %}',
+            request=self.request, name='second',
+        )
+        for view in ('first', 'second'):
+            self.assertIn(Token.objects.get(
+                for_view=get_view_id(view)).value, content)
+
+    def test_should_resolve_tokens_together(self):
+        """Test should resolve all tokens of template with two queries"""
+        template = Template('{% load session_csrf %}' + ''.join(
+            '{{% per_view_csrf "view_{}" %}}'.format(n) for n in range(20)))
+        with self.assertNumQueries(2):
+            template.render(Context({'request': self.request}))
+        with self.assertNumQueries(0):
+            template.render(Context({'request': self.request}))
+        self.assertEqual(Token.objects.count(), 20)
+
+    def test_should_reuse_existing_tokens(self):
+        """Test should reuse existing valid tokens"""
+        token = Token.objects.create(
+            owner=self.request.user, for_view=get_view_id('test'))
+        self.assertIn(token.value, self._render(
+            '{% per_view_csrf "test" %}', request=self.request,
+        ))
+        self.assertEqual(Token.objects.count(), 1)
@@ -1,8 +1,16 @@
-from mock import MagicMock
+import time
+from mock import MagicMock, patch
+from django.contrib.auth import logout
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 from ..models import Token
-from ..utils import save_token, get_token_for_request
+from ..utils import (
+    LazyToken, bump_user_generation, get_token_for_request,
+    get_user_generation, resolve_token, save_token)
+from ..backends.signed import SignedBackend
+from ..registry import get_view_id
+from .. import conf
 
 
 class TestUtils(TestCase):
@@ -20,7 +28,19 @@ class TestUtils(TestCase):
         user = User.objects.create()
         user.is_authenticated = lambda: True
         token = get_token_for_request(MagicMock(user=user), 'test')
-        self.assertIsInstance(token, Token)
+        self.assertTrue(Token.objects.has_valid(
+            user, token, get_view_id('test')))
+
+    def test_get_signed_token_for_authenticated(self):
+        """Test get signed token for authenticated"""
+        user = User.objects.create()
+        user.is_authenticated = lambda: True
+        with patch.object(conf, 'CSRF_TOKEN_BACKEND',
+                          'session_csrf.backends.signed.SignedBackend'):
+            token = get_token_for_request(MagicMock(user=user), 'test')
+        self.assertTrue(SignedBackend().validate(
+            user, token, get_view_id('test')))
+        self.assertFalse(Token.objects.exists())
 
     def test_get_none_for_anonymous(self):
         """Test get None for anonymous"""
@@ -28,3 +48,66 @@ class TestUtils(TestCase):
         request.user.is_authenticated.return_value = False
         token = get_token_for_request(request, 'test')
         self.assertIsNone(token)
+
+
+class TestLazyToken(TestCase):
+    """Test case for lazy token"""
+
+    def test_not_resolve_until_used(self):
+        """Test not resolve until used"""
+        resolve = MagicMock(return_value='token')
+        token = LazyToken(resolve)
+        self.assertFalse(resolve.called)
+        self.assertEqual(token, 'token')
+        self.assertEqual(len(token), 5)
+        self.assertEqual('csrf:' + token, 'csrf:token')
+        resolve.assert_called_once_with()
+
+    def test_resolve_token(self):
+        """Test resolve token"""
+        self.assertEqual(resolve_token(LazyToken(lambda: 'token')), 'token')
+        self.assertEqual(resolve_token('token'), 'token')
+
+
+class TestUserGeneration(TestCase):
+    """Test case for revocation generations of users"""
+
+    def setUp(self):
+        cache.clear()
+        self._user = User.objects.create_user('test', 'test@test.test', 'test')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_no_revocations(self):
+        """Test generation is 0 without revocations"""
+        self.assertEqual(get_user_generation(self._user), 0)
+
+    def test_bump(self):
+        """Test bump generation to the current time"""
+        started = time.time()
+        bump_user_generation(self._user)
+        self.assertGreaterEqual(get_user_generation(self._user), started)
+        self.assertLessEqual(get_user_generation(self._user), time.time())
+
+    def test_revoke_tokens_issued_in_the_same_second(self):
+        """Test revoke tokens issued just before the bump"""
+        token = Token.objects.create(owner=self._user)
+        bump_user_generation(self._user)
+        self.assertLess(Token.objects.get_issued(self._user, token.value),
+                        get_user_generation(self._user))
+
+    def test_bump_on_logout(self):
+        """Test bump generation on logout"""
+        request = MagicMock(user=self._user)
+        logout(request)
+        self.assertGreater(get_user_generation(self._user), 0)
+
+    def test_bump_on_password_change(self):
+        """Test bump generation when password is changed"""
+        user = User.objects.get(pk=self._user.pk)
+        user.save()
+        self.assertEqual(get_user_generation(user), 0)
+        user.set_password('changed')
+        user.save()
+        self.assertGreater(get_user_generation(user), 0)
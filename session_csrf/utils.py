@@ -1,7 +1,20 @@
 from contextlib import contextmanager
 import hashlib
-from .models import Token
-from . import conf
+import operator
+import re
+import time
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.functional import SimpleLazyObject, empty, new_method_proxy
+from django.utils.importlib import import_module
+from .backends import get_backend
+from .caches import get_csrf_cache
+from . import conf, registry, signals
+
+
+# Compiled exempt paths matchers by settings values:
+_exempt_paths = {}
+# Loaded exempt predicates by settings value:
+_exempt_predicates = {}
 
 
 def prep_key(key):
@@ -15,6 +28,68 @@ def prep_key(key):
     return hashlib.sha1(prefixed).hexdigest()
 
 
+def is_exempt_path(path):
+    """Is path exempt from csrf checks, prefixes and regexes from settings
+    are compiled once into one pattern"""
+    key = (tuple(conf.CSRF_EXEMPT_PATHS), tuple(conf.CSRF_EXEMPT_PATH_REGEXES))
+    if key not in _exempt_paths:
+        prefixes, regexes = key
+        patterns = [re.escape(prefix) for prefix in prefixes] + [
+            '(?:{})'.format(regex) for regex in regexes]
+        _exempt_paths[key] = re.compile('|'.join(patterns)).match \
+            if patterns else None
+    match = _exempt_paths[key]
+    return match is not None and match(path) is not None
+
+
+def _load_predicate(path):
+    module_path, _, name = path.rpartition('.')
+    try:
+        return getattr(import_module(module_path), name)
+    except (ImportError, AttributeError, ValueError) as e:
+        raise ImproperlyConfigured(
+            'Error loading csrf exempt predicate {}: {}'.format(path, e))
+
+
+def is_exempt_request(request):
+    """Is request of an API client exempt from csrf checks, by scheme of
+    the Authorization header or by predicates from settings"""
+    if conf.CSRF_EXEMPT_AUTH_SCHEMES:
+        scheme = request.META.get('HTTP_AUTHORIZATION', '').split(' ', 1)[0]
+        if scheme and scheme.lower() in (
+            name.lower() for name in conf.CSRF_EXEMPT_AUTH_SCHEMES
+        ):
+            return True
+    paths = tuple(conf.CSRF_EXEMPT_PREDICATES)
+    if paths not in _exempt_predicates:
+        _exempt_predicates[paths] = [_load_predicate(path) for path in paths]
+    return any(predicate(request) for predicate in _exempt_predicates[paths])
+
+
+class LazyToken(SimpleLazyObject):
+    """Token resolved on the first use"""
+    __len__ = new_method_proxy(len)
+    __iter__ = new_method_proxy(iter)
+    __contains__ = new_method_proxy(operator.contains)
+    __add__ = new_method_proxy(operator.add)
+
+    def __radd__(self, other):
+        return other + self.resolve()
+
+    def resolve(self):
+        """Get the token value"""
+        if self._wrapped is empty:
+            self._setup()
+        return self._wrapped
+
+
+def resolve_token(token):
+    """Get value of the token that can be lazy"""
+    if isinstance(token, LazyToken):
+        return token.resolve()
+    return token
+
+
 @contextmanager
 def save_token(context):
     """Restore token value in context"""
@@ -27,9 +102,55 @@ def save_token(context):
         del context['csrf_token']
 
 
-def get_token_for_request(request, view_name):
-    """Get token for request"""
+def get_token_generation(user):
+    """Get current generation of user tokens, the session proof of token
+    validity is stale when generations don't match"""
+    return conf.CSRF_TOKEN_GENERATION
+
+
+def _user_generation_key(user):
+    return prep_key('generation:{}'.format(user.pk))
+
+
+def get_user_generation(user):
+    """Get revocation generation of user from the shared cache, it's the
+    time of the last revocation and tokens issued before it aren't valid"""
+    return get_csrf_cache().get(_user_generation_key(user), 0)
+
+
+def bump_user_generation(user):
+    """Revoke all tokens of user issued before now, it's kept until these
+    tokens expire"""
+    get_csrf_cache().set(
+        _user_generation_key(user), time.time(),
+        int(conf.CSRF_TOKEN_LIFETIME.total_seconds()))
+
+
+def get_tokens_for_request(request, view_ids):
+    """Get token values for view ids, missing tokens are issued with one
+    backend call and cached on the request"""
     if request.user.is_authenticated():
-        token, _ = Token.objects.get_or_create(
-            owner=request.user, for_view=view_name)
-        return token
+        tokens = request.__dict__.setdefault('_per_view_csrf_tokens', {})
+        missing = set(view_ids) - set(
+            view for pk, view in tokens if pk == request.user.pk)
+        if missing:
+            started = time.time()
+            created = set()
+            for view, value in get_backend().issue_many(
+                request.user, missing, created,
+            ).items():
+                tokens[request.user.pk, view] = value
+            if created:
+                signals.tokens_issued.send(
+                    sender=None, user=request.user, views=list(created),
+                    duration=time.time() - started)
+        return dict((view, tokens[request.user.pk, view])
+                    for view in view_ids)
+
+
+def get_token_for_request(request, view_name):
+    """Get token value for request"""
+    view_id = registry.get_view_id(view_name)
+    tokens = get_tokens_for_request(request, [view_id])
+    if tokens is not None:
+        return tokens[view_id]